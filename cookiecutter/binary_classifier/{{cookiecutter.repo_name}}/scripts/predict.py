@@ -6,6 +6,7 @@ import numpy as np
 from sklearn.metrics import roc_auc_score, average_precision_score, accuracy_score, f1_score, precision_score, \
     recall_score
 
+from myautoml.evaluation.prediction import predict_labels, predict_proba
 from myautoml.utils import load_config
 from myautoml.utils.mlflow import get_registered_model
 
@@ -28,8 +29,8 @@ def main():
     model, model_version = get_registered_model(config.model.name, config.prediction.stage)
 
     _logger.info("Making predictions")
-    y_pred = model.predict(x)
-    y_pred_proba = model.predict_proba(x)[:, 1]
+    y_pred_proba = predict_proba(model, x)
+    y_pred = predict_labels(model, y_pred_proba)
 
     _logger.info("Checking predictions")
     metrics = {
@@ -13,7 +13,7 @@ from myautoml.calibration import calibrate_model
 from myautoml.utils import load_config
 from myautoml.utils.hyperopt import flatten_params, prep_params
 from myautoml.utils.mlflow import log_sk_model
-from myautoml.utils.model import make_pipeline
+from myautoml.utils.model import fit_preprocessor, make_pipeline
 
 from data import load_training_data, split_data
 from model import get_preprocessor, get_estimator, get_params
@@ -21,7 +21,8 @@ from model import get_preprocessor, get_estimator, get_params
 _logger = logging.getLogger(__file__)
 
 
-def train_run(estimator_params, x_train_prep, y_train, x_test_prep, y_test, temp_dir):
+def train_run(estimator_params, x_train_prep, y_train, x_test_prep, y_test, temp_dir, cv=5, cv_n_jobs=None,
+              n_bootstrap=0, bootstrap_random_state=None):
     temp_dir.mkdir(parents=True, exist_ok=True)
     _logger.info("Fitting the estimator")
     estimator, estimator_tags = get_estimator(**estimator_params)
@@ -31,7 +32,11 @@ def train_run(estimator_params, x_train_prep, y_train, x_test_prep, y_test, temp
         model=estimator,
         data={'train': {'x': x_train_prep, 'y': y_train},
               'test': {'x': x_test_prep, 'y': y_test}},
-        temp_dir=temp_dir)
+        temp_dir=temp_dir,
+        cv=cv,
+        cv_n_jobs=cv_n_jobs,
+        n_bootstrap=n_bootstrap,
+        random_state=bootstrap_random_state)
     return estimator, estimator_tags, estimator_metrics, estimator_artifacts
 
 
@@ -57,13 +62,10 @@ def main():
 
         with mlflow.start_run() as run:
             run_id = run.info.run_id
-            _logger.info("Fitting the preprocessor")
-            preprocessor = get_preprocessor()
-            preprocessor.fit(x_train, y_train)
-
-            _logger.info("Preprocessing the training data")
-            x_train_prep = preprocessor.transform(x_train)
-            x_test_prep = preprocessor.transform(x_test)
+            _logger.info("Fitting the preprocessor and preprocessing the training data")
+            preprocessor, (x_train_prep, x_test_prep) = fit_preprocessor(get_preprocessor(), x_train, y_train,
+                                                                         transform=[x_train, x_test],
+                                                                         cache=config.training.cache_preprocessing)
 
             estimator_params, search_space = get_params()
 
@@ -74,7 +76,11 @@ def main():
                     y_train=y_train,
                     x_test_prep=x_test_prep,
                     y_test=y_test,
-                    temp_dir=temp_dir)
+                    temp_dir=temp_dir,
+                    cv=config.training.cv,
+                    cv_n_jobs=config.training.cv_n_jobs,
+                    n_bootstrap=config.evaluation.n_bootstrap,
+                    bootstrap_random_state=config.evaluation.bootstrap_random_state)
 
                 model = make_pipeline(preprocessor, estimator)
                 params.update({f"estimator_{k}": v for k, v in estimator_params.items()})
@@ -103,7 +109,11 @@ def main():
                             y_train=y_train,
                             x_test_prep=x_test_prep,
                             y_test=y_test,
-                            temp_dir=temp_dir / run_name)
+                            temp_dir=temp_dir / run_name,
+                            cv=config.training.cv,
+                            cv_n_jobs=config.training.cv_n_jobs,
+                            n_bootstrap=config.evaluation.n_bootstrap,
+                            bootstrap_random_state=config.evaluation.bootstrap_random_state)
 
                         ho_model = make_pipeline(preprocessor, ho_estimator)
                         ho_params.update({f"estimator_{k}": v for k, v in ho_estimator_params.items()})
@@ -145,7 +155,14 @@ def main():
 
             if config.evaluation.shap_analysis:
                 _logger.info("Starting shap analysis")
-                shap_tags, shap_artifacts = shap_analyse(model=model, x=x_train, temp_dir=Path(temp_dir) / 'shap')
+                shap_tags, shap_artifacts = shap_analyse(model=model, x=x_train, y=y_train,
+                                                         temp_dir=Path(temp_dir) / 'shap',
+                                                         sample_size=config.evaluation.shap_sample_size,
+                                                         background_size=config.evaluation.shap_background_size,
+                                                         n_jobs=config.evaluation.shap_n_jobs,
+                                                         dependence_top_k=config.evaluation.shap_dependence_top_k,
+                                                         cache=config.evaluation.shap_cache,
+                                                         random_state=1)
                 tags.update(shap_tags)
                 artifacts.update(shap_artifacts)
             else:
@@ -18,6 +18,7 @@ with open("README.md", "r") as fh:
 
 # Optional dependencies
 extras = {
+    'cache': ['pyarrow'],
     'evaluation': ['shap'],
     'optimisation': ['hyperopt'],
     'tracking': ['mlflow'],
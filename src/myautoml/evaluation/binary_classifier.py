@@ -1,117 +1,341 @@
 import logging
+from pathlib import Path
 
-from sklearn.metrics import roc_auc_score, average_precision_score, accuracy_score, f1_score, precision_score, \
-    recall_score
-from sklearn.model_selection import cross_validate
+from joblib import Parallel, delayed
+import numpy as np
 
+from myautoml.evaluation.bootstrap import bootstrap_metrics
+from myautoml.evaluation.cross_validation import cross_validate_binary_classifier
+from myautoml.evaluation.curves import BinaryClassifierCurves
+from myautoml.evaluation.prediction import predict_labels, predict_proba
+from myautoml.evaluation.stored_curves import load_curves, load_curves_plots, save_curves
 from myautoml.visualisation.evaluation.binary_classifier import (
     save_roc_curve, save_cum_precision, save_prediction_distribution, save_lift_deciles, save_precision_recall_curve,
     save_calibration_curve, save_calibration_curve_zoom)
 
 _logger = logging.getLogger(__name__)
 
+# The plots of plots='all' in evaluate_binary_classifier and evaluate_calibration
+EVALUATION_PLOTS = ['roc', 'pr', 'lift_deciles', 'cum_precision', 'distribution']
+CALIBRATION_PLOTS = ['curve', 'curve_zoom', *EVALUATION_PLOTS]
 
-def get_metrics(model, data, prefix=None):
-    _logger.debug(f"Starting computing the metrics")
+
+def _get_prefix(prefix):
     if prefix is None:
-        prefix = ''
+        return ''
     elif len(prefix) > 0 and (not prefix[-1:] == "_"):
-        prefix = prefix + "_"
+        return prefix + "_"
+    return prefix
+
 
+def get_curves_metrics(curves, prefix=None, threshold=0.5, threshold_objective=None, utility=None):
+    """
+    Computes the evaluation metrics of a binary classifier from its curves, e.g. accumulated chunk by chunk in a
+    myautoml.evaluation.streaming.StreamingBinaryClassifierCurves, with the same names as get_metrics.
+
+    :param curves:      A dict with the curves of each data set, e.g. {'train': ..., 'test': ...}
+    :param prefix:      Optional prefix of the metric names
+    :param threshold:   The probability threshold above which the positive class is predicted
+    :param threshold_objective: If set, the threshold that maximises this objective (e.g. 'f1' or 'utility') is added
+                                as optimal_threshold_{label}, and its value as optimal_{objective}_{label}
+                                (see myautoml.evaluation.curves.BinaryClassifierCurves.optimal_threshold)
+    :param utility:     The weights of the utility objective (see BinaryClassifierCurves.threshold_sweep)
+    :return:            A dict with the metrics
+    """
+    prefix = _get_prefix(prefix)
     metrics = {}
+    for label, label_curves in curves.items():
+        metrics[f"{prefix}roc_auc_{label}"] = label_curves.roc_auc()
+        metrics[f"{prefix}average_precision_{label}"] = label_curves.average_precision()
+        for name, value in label_curves.classification_metrics(threshold).items():
+            metrics[f"{prefix}{name}_{label}"] = value
+        if threshold_objective:
+            optimal_threshold, optimal_value = label_curves.optimal_threshold(threshold_objective, utility=utility)
+            metrics[f"{prefix}optimal_threshold_{label}"] = optimal_threshold
+            metrics[f"{prefix}optimal_{threshold_objective}_{label}"] = optimal_value
+    return metrics
+
+
+def get_metrics(model, data, prefix=None, threshold=0.5, chunk_size=None, n_jobs=None, n_bootstrap=0,
+                confidence=0.95, random_state=None, threshold_objective=None, utility=None):
+    """
+    Computes the evaluation metrics of a binary classifier for each data set in data.
+
+    The model predicts the probabilities only once per data set (see myautoml.evaluation.prediction.predict_proba),
+    the predicted labels are derived from them with the threshold. The predictions are stored in the data dict, to be
+    reused by the plots.
+
+    If n_bootstrap is set, the bootstrap confidence intervals of the ROC AUC, average precision, precision and recall
+    are added as {metric}_{label}_ci_low and {metric}_{label}_ci_high (see myautoml.evaluation.bootstrap).
+
+    :param model:       The (fitted) binary classifier
+    :param data:        A dict of data sets, e.g. {'train': {'x': x_train, 'y': y_train}, 'test': {...}}
+    :param prefix:      Optional prefix of the metric names
+    :param threshold:   The probability threshold above which the positive class is predicted
+    :param chunk_size:  The maximum number of rows to predict at once, or None to predict all rows at once
+    :param n_jobs:      The number of parallel jobs to predict the chunks with
+    :param n_bootstrap: The number of bootstrap replicates of the confidence intervals, or 0 to skip them
+    :param confidence:  The confidence level of the confidence intervals
+    :param random_state: The seed or numpy Generator of the bootstrap replicates. With None, the confidence intervals
+                        differ between runs.
+    :param threshold_objective: The objective of the optimal threshold to add, or None (see get_curves_metrics)
+    :param utility:     The weights of the utility objective (see get_curves_metrics)
+    :return:            A dict with the metrics
+    """
+    _logger.debug(f"Starting computing the metrics")
     for label in data.keys():
         x = data[label]['x']
         y_true = data[label]['y']
-        y_pred = data[label]['y_pred'] = model.predict(x)
-        y_pred_proba = data[label]['y_pred_proba'] = model.predict_proba(x)[:, 1]
+        y_pred_proba = data[label]['y_pred_proba'] = predict_proba(model, x, chunk_size=chunk_size, n_jobs=n_jobs)
+        data[label]['y_pred'] = predict_labels(model, y_pred_proba, threshold=threshold)
+        # The predictions are sorted once, and the curves are reused for the metrics and the plots
+        data[label]['curves'] = BinaryClassifierCurves(y_true, y_pred_proba)
 
-        metrics[f"{prefix}roc_auc_{label}"] = roc_auc_score(y_true, y_pred_proba)
-        metrics[f"{prefix}average_precision_{label}"] = average_precision_score(y_true, y_pred_proba)
-        metrics[f"{prefix}accuracy_{label}"] = accuracy_score(y_true, y_pred)
-        metrics[f"{prefix}f1_{label}"] = f1_score(y_true, y_pred)
-        metrics[f"{prefix}precision_{label}"] = precision_score(y_true, y_pred)
-        metrics[f"{prefix}recall_{label}"] = recall_score(y_true, y_pred)
+    metrics = get_curves_metrics({label: data[label]['curves'] for label in data.keys()}, prefix=prefix,
+                                 threshold=threshold, threshold_objective=threshold_objective, utility=utility)
+
+    if n_bootstrap:
+        _logger.debug("Starting computing the bootstrap confidence intervals")
+        prefix = _get_prefix(prefix)
+        rng = np.random.default_rng(random_state)
+        for label in data.keys():
+            intervals = bootstrap_metrics(data[label]['curves'], n_bootstrap=n_bootstrap, threshold=threshold,
+                                          confidence=confidence, random_state=rng)
+            for name, (low, high) in intervals.items():
+                metrics[f"{prefix}{name}_{label}_ci_low"] = low
+                metrics[f"{prefix}{name}_{label}_ci_high"] = high
 
     return metrics
 
 
-def get_plots(temp_dir, data, plots, plot_path='evaluation'):
-    artifacts = {}
+def save_threshold_sweeps(save_dir, data, utility=None):
+    """
+    Saves the threshold sweep of each data set as a CSV file, with the confusion matrix and metrics at every distinct
+    threshold (see myautoml.evaluation.curves.BinaryClassifierCurves.threshold_sweep).
+
+    :param save_dir:    The directory to save the files in
+    :param data:        The data sets, with the curves computed by get_metrics
+    :param utility:     The weights of the utility
+    :return:            A list with the paths of the files
+    """
+    _logger.debug("Saving the threshold sweeps")
+    paths = []
+    for label in data.keys():
+        save_path = Path(save_dir) / f'threshold_sweep_{label}.csv'
+        try:
+            data[label]['curves'].threshold_sweep(utility=utility).to_csv(save_path, index=False)
+            paths.append(save_path)
+        except Exception as e:
+            _logger.warning(f"Error saving the threshold sweep of {label}: {str(e)}")
+    return paths
+
+
+def save_lift_tables(save_dir, data, n_bins=10):
+    """
+    Saves the gain and lift table of each data set as a CSV file (see
+    myautoml.evaluation.curves.BinaryClassifierCurves.lift_table).
+
+    :param save_dir:    The directory to save the files in
+    :param data:        The data sets, with the curves computed by get_metrics
+    :param n_bins:      The number of quantile bins
+    :return:            A list with the paths of the files
+    """
+    _logger.debug("Saving the lift tables")
+    paths = []
+    for label in data.keys():
+        save_path = Path(save_dir) / f'lift_table_{label}.csv'
+        try:
+            data[label]['curves'].lift_table(n_bins=n_bins).to_csv(save_path, index=False)
+            paths.append(save_path)
+        except Exception as e:
+            _logger.warning(f"Error saving the lift table of {label}: {str(e)}")
+    return paths
+
+
+def _slim_data(data):
+    # The plots only need the curves (or the labels and predictions if there are no curves), so the data sets
+    # themselves are not sent to the worker processes
+    slim_data = {}
+    for label in data.keys():
+        curves = data[label].get('curves')
+        if curves is None:
+            slim_data[label] = {'y': data[label]['y'], 'y_pred_proba': data[label]['y_pred_proba']}
+        else:
+            slim_data[label] = {'y': None, 'y_pred_proba': None, 'curves': curves}
+    return slim_data
+
+
+def get_plots(temp_dir, data, plots, plot_path='evaluation', n_jobs=None):
+    """
+    Saves the evaluation plots.
+
+    The plots are rendered without pyplot (see myautoml.visualisation.evaluation.binary_classifier), so with n_jobs,
+    they are rendered concurrently in a pool of worker processes (see joblib.Parallel).
+
+    :param temp_dir:    The directory to save the plots in
+    :param data:        The data sets, with the predictions or curves computed by get_metrics
+    :param plots:       The plots to save
+    :param plot_path:   The artifact path of the plots
+    :param n_jobs:      The number of plots to render in parallel
+    :return:            A dict with the artifacts
+    """
+    Path(temp_dir).mkdir(parents=True, exist_ok=True)
+    save_functions = []
 
     # Standard evaluation plots
     if 'roc' in plots:
-        roc_curve_path = save_roc_curve(temp_dir, data)
-        if roc_curve_path:
-            artifacts[roc_curve_path] = plot_path
-
+        save_functions.append(save_roc_curve)
     if 'pr' in plots:
-        pr_curve_path = save_precision_recall_curve(temp_dir, data)
-        if pr_curve_path:
-            artifacts[pr_curve_path] = plot_path
-
+        save_functions.append(save_precision_recall_curve)
     if 'lift_deciles' in plots:
-        lift_deciles_path = save_lift_deciles(temp_dir, data)
-        if lift_deciles_path:
-            artifacts[lift_deciles_path] = plot_path
-
+        save_functions.append(save_lift_deciles)
     if 'cum_precision' in plots:
-        cum_precision_path = save_cum_precision(temp_dir, data)
-        if cum_precision_path:
-            artifacts[cum_precision_path] = plot_path
-
+        save_functions.append(save_cum_precision)
     if 'distribution' in plots:
-        distribution_path = save_prediction_distribution(temp_dir, data)
-        if distribution_path:
-            artifacts[distribution_path] = plot_path
+        save_functions.append(save_prediction_distribution)
 
     # Calibration plots
     if 'curve' in plots:
-        calibration_curve_path = save_calibration_curve(temp_dir, data)
-        if calibration_curve_path:
-            artifacts[calibration_curve_path] = plot_path
+        save_functions.append(save_calibration_curve)
+        save_functions.append(save_calibration_curve_zoom)
+
+    if n_jobs is None or n_jobs == 1 or len(save_functions) <= 1:
+        paths = [save_function(temp_dir, data) for save_function in save_functions]
+    else:
+        _logger.debug(f"Rendering {len(save_functions)} plots in parallel (n_jobs={n_jobs})")
+        slim_data = _slim_data(data)
+        paths = Parallel(n_jobs=n_jobs)(
+            delayed(save_function)(temp_dir, slim_data) for save_function in save_functions)
+
+    return {path: plot_path for path in paths if path}
 
-    if 'curve' in plots:
-        calibration_curve_zoom_path = save_calibration_curve_zoom(temp_dir, data)
-        if calibration_curve_zoom_path:
-            artifacts[calibration_curve_zoom_path] = plot_path
 
-    return artifacts
+def render_curves(curves_path, temp_dir, plots=None, plot_path='evaluation', n_jobs=None):
+    """
+    Renders the evaluation plots from the curves stored by save_curves, e.g. a curves.npz artifact of a run.
 
+    Example:
+        curves_path = MlflowClient().download_artifacts(run_id, 'evaluation/curves.npz', temp_dir)
+        artifacts = render_curves(curves_path, temp_dir)
 
-def evaluate_binary_classifier(model, data, temp_dir, plots='all'):
+    :param curves_path: The path of the stored curves
+    :param temp_dir:    The directory to save the plots in
+    :param plots:       The plots to save, 'all', or None to save the plots the run was evaluated with
+    :param plot_path:   The artifact path of the plots
+    :param n_jobs:      The number of plots to render in parallel (see get_plots)
+    :return:            A dict with the artifacts
+    """
+    if plots is None:
+        plots = load_curves_plots(curves_path)
+    if plots is None or plots == 'all':
+        plots = CALIBRATION_PLOTS
+    data = {label: {'y': None, 'y_pred_proba': None, 'curves': curves}
+            for label, curves in load_curves(curves_path).items()}
+    return get_plots(temp_dir, data, plots, plot_path=plot_path, n_jobs=n_jobs)
+
+
+def evaluate_binary_classifier(model, data, temp_dir, plots='all', threshold=0.5, chunk_size=None, n_jobs=None,
+                               cv=5, cv_stratified=True, cv_random_state=None, cv_n_jobs=None, n_bootstrap=0,
+                               random_state=None, plot_n_jobs=None, curves_artifact=False, threshold_objective=None,
+                               utility=None, threshold_sweep=False, lift_table=False):
+    """
+    Evaluates a binary classifier: computes the metrics on each data set, cross-validates it on the train data and
+    saves the evaluation plots.
+
+    :param model:           The (fitted) binary classifier
+    :param data:            A dict of data sets, which should contain 'train' to cross-validate on
+    :param temp_dir:        The directory to save the plots in
+    :param plots:           The plots to save, 'all', or None to save no plots
+    :param threshold:       The probability threshold above which the positive class is predicted
+    :param chunk_size:      The maximum number of rows to predict at once (see get_metrics)
+    :param n_jobs:          The number of parallel jobs to predict the chunks with (see get_metrics)
+    :param cv:              The number of folds, 'holdout' for a single train/test split, or None (or 0) to skip the
+                            cross-validation (see myautoml.evaluation.cross_validation.get_cv_splits)
+    :param cv_stratified:   Boolean indicator to specify whether the folds should preserve the class balance
+    :param cv_random_state: The random state to shuffle the rows with before splitting, or None to not shuffle
+    :param cv_n_jobs:       The number of folds to fit in parallel
+    :param n_bootstrap:     The number of bootstrap replicates of the confidence intervals of the metrics, or 0 to
+                            skip them (see get_metrics)
+    :param random_state:    The seed of the bootstrap replicates (see get_metrics)
+    :param plot_n_jobs:     The number of plots to render in parallel (see get_plots)
+    :param curves_artifact: Boolean indicator to specify whether the curves should be saved as a compact curves.npz
+                            artifact, from which the plots can be rendered later (see render_curves). Combined with
+                            plots=None, only the curves are saved.
+    :param threshold_objective: The objective of the optimal threshold to add to the metrics, e.g. 'f1' or
+                            'utility', or None (see get_curves_metrics)
+    :param utility:         The weights of the utility objective (see BinaryClassifierCurves.threshold_sweep)
+    :param threshold_sweep: Boolean indicator to specify whether the threshold sweep of each data set should be saved
+                            as a CSV artifact (see save_threshold_sweeps)
+    :param lift_table:      Boolean indicator to specify whether the gain and lift table (of the deciles) of each data
+                            set should be saved as a CSV artifact (see save_lift_tables)
+    :return:                The metrics and the artifacts
+    """
     _logger.debug(f"Starting evaluation for binary classifier")
 
-    metrics = get_metrics(model, data)
+    metrics = get_metrics(model, data, threshold=threshold, chunk_size=chunk_size, n_jobs=n_jobs,
+                          n_bootstrap=n_bootstrap, random_state=random_state, threshold_objective=threshold_objective,
+                          utility=utility)
 
-    _logger.debug(f"Starting cross-validation for binary classifier")
-    scorers = ['roc_auc', 'accuracy', 'f1', 'average_precision', 'precision', 'recall']
-    cv_results = cross_validate(estimator=model, X=data['train']['x'], y=data['train']['y'],
-                                scoring=scorers, cv=5)
-    for scorer in scorers:
-        metrics[f"{scorer}_cv"] = cv_results[f"test_{scorer}"].mean()
+    if cv:
+        _logger.debug(f"Starting cross-validation for binary classifier")
+        cv_scores = cross_validate_binary_classifier(model, data['train']['x'], data['train']['y'], cv=cv,
+                                                     stratified=cv_stratified, random_state=cv_random_state,
+                                                     threshold=threshold, n_jobs=cv_n_jobs)
+        for scorer, score in cv_scores.items():
+            metrics[f"{scorer}_cv"] = score
+    else:
+        _logger.debug("Cross-validation skipped")
 
     if plots is None or plots == "":
         artifacts = {}
     else:
         if plots == 'all':
-            plots = ['roc', 'pr', 'lift_deciles', 'cum_precision', 'distribution']
+            plots = EVALUATION_PLOTS
+
+        artifacts = get_plots(temp_dir, data, plots, plot_path='evaluation', n_jobs=plot_n_jobs)
 
-        artifacts = get_plots(temp_dir, data, plots, plot_path='evaluation')
+    if curves_artifact:
+        # Without plots, the curves are saved to render the default plots later
+        curves_path = save_curves(temp_dir, data, plots=plots or EVALUATION_PLOTS)
+        if curves_path:
+            artifacts[curves_path] = 'evaluation'
+
+    if threshold_sweep:
+        artifacts.update({path: 'evaluation' for path in save_threshold_sweeps(temp_dir, data, utility=utility)})
+
+    if lift_table:
+        artifacts.update({path: 'evaluation' for path in save_lift_tables(temp_dir, data)})
 
     return metrics, artifacts
 
 
-def evaluate_calibration(model, data, temp_dir, plots='all'):
+def evaluate_calibration(model, data, temp_dir, plots='all', threshold=0.5, chunk_size=None, n_jobs=None,
+                         n_bootstrap=0, random_state=None, plot_n_jobs=None, curves_artifact=False,
+                         threshold_objective=None, utility=None, threshold_sweep=False, lift_table=False):
     _logger.debug(f"Starting evaluation calibration for binary classifier")
 
-    metrics = get_metrics(model, data, prefix='calibration')
+    metrics = get_metrics(model, data, prefix='calibration', threshold=threshold, chunk_size=chunk_size,
+                          n_jobs=n_jobs, n_bootstrap=n_bootstrap, random_state=random_state,
+                          threshold_objective=threshold_objective, utility=utility)
 
     if plots is None or plots == "":
         artifacts = {}
     else:
         if plots == 'all':
-            plots = ['curve', 'curve_zoom', 'roc', 'pr', 'lift_deciles', 'cum_precision', 'distribution']
+            plots = CALIBRATION_PLOTS
+
+        artifacts = get_plots(temp_dir, data, plots, plot_path='evaluation_calibration', n_jobs=plot_n_jobs)
+
+    if curves_artifact:
+        curves_path = save_curves(temp_dir, data, plots=plots or CALIBRATION_PLOTS)
+        if curves_path:
+            artifacts[curves_path] = 'evaluation_calibration'
+
+    if threshold_sweep:
+        artifacts.update({path: 'evaluation_calibration'
+                          for path in save_threshold_sweeps(temp_dir, data, utility=utility)})
 
-        artifacts = get_plots(temp_dir, data, plots, plot_path='evaluation_calibration')
+    if lift_table:
+        artifacts.update({path: 'evaluation_calibration' for path in save_lift_tables(temp_dir, data)})
 
     return metrics, artifacts
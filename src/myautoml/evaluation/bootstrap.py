@@ -0,0 +1,94 @@
+import logging
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+BOOTSTRAP_METRICS = ['roc_auc', 'average_precision', 'precision', 'recall']
+
+# The maximum number of elements of the weight matrices of a batch of replicates
+_MAX_BATCH_ELEMENTS = 2 ** 23
+
+
+def _draw_weights(rng, n_replicates, n):
+    # Draws n rows with replacement per replicate, and counts the number of times each row is drawn
+    draws = rng.integers(0, n, size=(n_replicates, n)) + np.arange(n_replicates)[:, None] * n
+    return np.bincount(draws.ravel(), minlength=n_replicates * n).reshape(n_replicates, n).astype(np.int32)
+
+
+def _replicate_metrics(y_true, threshold_idxs, n_above, weights):
+    # The weighted number of true and false positives at each distinct threshold, per replicate (row)
+    tps = np.cumsum(weights * y_true, axis=1, dtype=np.int32)
+    fps = np.cumsum(weights, axis=1, dtype=np.int32) - tps
+    n_pos = tps[:, -1].astype(float)
+    n_neg = fps[:, -1].astype(float)
+    threshold_tps = tps[:, threshold_idxs] if threshold_idxs is not None else tps
+    threshold_fps = fps[:, threshold_idxs] if threshold_idxs is not None else fps
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tpr = np.c_[np.zeros(len(weights)), threshold_tps] / n_pos[:, None]
+        fpr = np.c_[np.zeros(len(weights)), threshold_fps] / n_neg[:, None]
+        tpr_diff = np.diff(tpr, axis=1)
+        roc_auc = np.sum(np.diff(fpr, axis=1) * (tpr[:, 1:] + tpr[:, :-1]), axis=1) / 2
+
+        # The average precision is the sum of the precision at each threshold, weighted by the increase in recall
+        predicted_pos = threshold_tps + threshold_fps
+        average_precision = np.sum(tpr_diff * threshold_tps / np.maximum(predicted_pos, 1), axis=1)
+
+        # The precision and recall at the threshold
+        if n_above > 0:
+            tp, fp = tps[:, n_above - 1], fps[:, n_above - 1]
+        else:
+            tp, fp = np.zeros(len(weights)), np.zeros(len(weights))
+        precision = np.where(tp > 0, tp / np.maximum(tp + fp, 1), 0.)
+        recall = np.where(tp > 0, tp / n_pos, 0.)
+
+    # The ROC AUC and average precision are undefined for replicates without positives or negatives
+    undefined = (n_pos == 0) | (n_neg == 0)
+    roc_auc[undefined] = np.nan
+    average_precision[n_pos == 0] = np.nan
+    return {'roc_auc': roc_auc, 'average_precision': average_precision, 'precision': precision, 'recall': recall}
+
+
+def bootstrap_metrics(curves, n_bootstrap=200, threshold=0.5, confidence=0.95, random_state=None):
+    """
+    Computes bootstrap confidence intervals of the ROC AUC, average precision, precision and recall.
+
+    Each replicate resamples the predictions with replacement, represented by weights: the number of times each
+    prediction is drawn. Since resampling does not change the order of the predictions, all replicates use the single
+    sort of the curves: the weights of a batch of replicates are drawn as a matrix, and the metrics of all replicates
+    in the batch are computed at once from weighted cumulative sums.
+
+    :param curves:          The BinaryClassifierCurves of the predictions
+    :param n_bootstrap:     The number of bootstrap replicates
+    :param threshold:       The probability threshold above which the positive class is predicted
+    :param confidence:      The confidence level of the intervals
+    :param random_state:    The seed or numpy Generator to draw the weights with
+    :return:                A dict with a (low, high) tuple for each metric in BOOTSTRAP_METRICS
+    """
+    rng = np.random.default_rng(random_state)
+    y_true = curves.y_true
+    threshold_idxs = np.r_[np.flatnonzero(np.diff(curves.y_score)), curves.n - 1]
+    if len(threshold_idxs) == curves.n:
+        # All probabilities are distinct, so every prediction is a threshold
+        threshold_idxs = None
+    n_above = int(np.searchsorted(-curves.y_score, -threshold, side='left'))
+
+    batch_size = max(1, min(n_bootstrap, _MAX_BATCH_ELEMENTS // max(curves.n, 1)))
+    _logger.debug(f"Computing {n_bootstrap} bootstrap replicates in batches of {batch_size}")
+    results = {metric: [] for metric in BOOTSTRAP_METRICS}
+    for start in range(0, n_bootstrap, batch_size):
+        weights = _draw_weights(rng, min(batch_size, n_bootstrap - start), curves.n)
+        for metric, values in _replicate_metrics(y_true, threshold_idxs, n_above, weights).items():
+            results[metric].append(values)
+
+    alpha = (1 - confidence) / 2
+    intervals = {}
+    for metric in BOOTSTRAP_METRICS:
+        values = np.concatenate(results[metric])
+        if np.all(np.isnan(values)):
+            intervals[metric] = (np.nan, np.nan)
+        else:
+            low, high = np.nanquantile(values, [alpha, 1 - alpha])
+            intervals[metric] = (float(low), float(high))
+    return intervals
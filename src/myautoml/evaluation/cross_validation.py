@@ -0,0 +1,101 @@
+import logging
+
+from joblib import Parallel, delayed
+import numpy as np
+from sklearn.base import clone
+from sklearn.model_selection import KFold, StratifiedKFold, train_test_split
+
+from myautoml.evaluation.curves import BinaryClassifierCurves
+from myautoml.evaluation.prediction import _take_rows, predict_proba
+from myautoml.utils.fingerprint import fingerprint
+
+_logger = logging.getLogger(__name__)
+
+SCORERS = ['roc_auc', 'accuracy', 'f1', 'average_precision', 'precision', 'recall']
+
+# The fold splits, reused across calls (e.g. the trials of a hyperopt search) with the same target and strategy
+_cv_splits = {}
+_MAX_CV_SPLITS = 16
+
+
+def get_cv_splits(y, cv=5, stratified=True, holdout_size=0.2, random_state=None):
+    """
+    Returns the (train, test) indices of the folds of a cross-validation strategy.
+
+    The splits are cached in memory, keyed by a fingerprint of y and the strategy, so that repeated evaluations on the
+    same data (e.g. all trials of a hyperopt search) are compared on the same folds, without splitting again.
+
+    :param y:               The target
+    :param cv:              The number of folds, or 'holdout' for a single train/test split
+    :param stratified:      Boolean indicator to specify whether the folds should preserve the class balance
+    :param holdout_size:    The fraction of the rows in the test set, if cv is 'holdout'
+    :param random_state:    The random state to shuffle the rows with, or None to split without shuffling
+                            (the holdout split always shuffles)
+    :return:                A list of (train indices, test indices) tuples
+    """
+    key = (fingerprint(y), cv, stratified, holdout_size, random_state)
+    if key in _cv_splits:
+        _logger.debug(f"Reusing the cached cross-validation splits (cv={cv})")
+        return _cv_splits[key]
+
+    y = np.asarray(y)
+    if cv == 'holdout':
+        indices = np.arange(len(y))
+        train_idx, test_idx = train_test_split(indices, test_size=holdout_size, random_state=random_state,
+                                               stratify=y if stratified else None)
+        splits = [(np.sort(train_idx), np.sort(test_idx))]
+    elif isinstance(cv, int) and cv >= 2:
+        shuffle = random_state is not None
+        splitter_class = StratifiedKFold if stratified else KFold
+        splitter = splitter_class(n_splits=cv, shuffle=shuffle, random_state=random_state)
+        splits = list(splitter.split(np.zeros((len(y), 1)), y))
+    else:
+        raise ValueError(f"Invalid cross-validation strategy: {cv!r}. Expected a number of folds >= 2 or 'holdout'.")
+
+    if len(_cv_splits) >= _MAX_CV_SPLITS:
+        _cv_splits.pop(next(iter(_cv_splits)))
+    _cv_splits[key] = splits
+    return splits
+
+
+def clear_cv_splits():
+    """Clears the cached cross-validation splits."""
+    _cv_splits.clear()
+
+
+def _score_fold(model, x, y, train_idx, test_idx, threshold):
+    fitted_model = clone(model).fit(_take_rows(x, train_idx), _take_rows(y, train_idx))
+    # The out-of-fold probabilities are predicted once, and all scores are derived from them
+    y_pred_proba = predict_proba(fitted_model, _take_rows(x, test_idx))
+    curves = BinaryClassifierCurves(_take_rows(y, test_idx), y_pred_proba)
+    scores = curves.classification_metrics(threshold)
+    scores['roc_auc'] = curves.roc_auc()
+    scores['average_precision'] = curves.average_precision()
+    return scores
+
+
+def cross_validate_binary_classifier(model, x, y, cv=5, stratified=True, holdout_size=0.2, random_state=None,
+                                     threshold=0.5, n_jobs=None):
+    """
+    Cross-validates a binary classifier, and returns the mean of each score over the folds.
+
+    The folds are fitted in parallel if n_jobs is set. Per fold, the out-of-fold probabilities are predicted once, and
+    all scores are derived from them (see myautoml.evaluation.curves.BinaryClassifierCurves), instead of predicting
+    once per scorer like sklearn.model_selection.cross_validate.
+
+    :param model:           The binary classifier, which is cloned and fitted on each fold
+    :param x:               The data
+    :param y:               The target
+    :param cv:              The number of folds, or 'holdout' for a single train/test split (see get_cv_splits)
+    :param stratified:      Boolean indicator to specify whether the folds should preserve the class balance
+    :param holdout_size:    The fraction of the rows in the test set, if cv is 'holdout'
+    :param random_state:    The random state to shuffle the rows with, or None to split without shuffling
+    :param threshold:       The probability threshold above which the positive class is predicted
+    :param n_jobs:          The number of folds to fit in parallel (see joblib.Parallel)
+    :return:                A dict with the mean score of each scorer in SCORERS
+    """
+    splits = get_cv_splits(y, cv=cv, stratified=stratified, holdout_size=holdout_size, random_state=random_state)
+    _logger.debug(f"Cross-validating on {len(splits)} folds (n_jobs={n_jobs})")
+    fold_scores = Parallel(n_jobs=n_jobs)(
+        delayed(_score_fold)(model, x, y, train_idx, test_idx, threshold) for train_idx, test_idx in splits)
+    return {scorer: float(np.mean([scores[scorer] for scores in fold_scores])) for scorer in SCORERS}
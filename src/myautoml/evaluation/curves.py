@@ -0,0 +1,319 @@
+from functools import cached_property
+import logging
+
+import numpy as np
+import pandas as pd
+
+_logger = logging.getLogger(__name__)
+
+# The default weights of the utility of the threshold sweep: the gain of each true positive and the cost of each
+# false positive
+DEFAULT_UTILITY = {'tp': 1., 'fp': -1., 'tn': 0., 'fn': 0.}
+
+
+def _trapezoid(x, y):
+    return np.sum(np.diff(x) * (y[1:] + y[:-1]) / 2)
+
+
+def sorted_quantiles(sorted_values, q):
+    """Computes (linearly interpolated) quantiles of values that are already sorted in ascending order."""
+    q = np.asarray(q, dtype=float)
+    position = q * (len(sorted_values) - 1)
+    lower = np.floor(position).astype(int)
+    upper = np.ceil(position).astype(int)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def lift_table(y_true, y_pred_proba, n_bins=10, pos_label=1):
+    """
+    Returns the gain and lift table of the quantile bins of the predicted probabilities (see
+    BinaryClassifierCurves.lift_table).
+
+    :param y_true:          The true labels
+    :param y_pred_proba:    The predicted probabilities of the positive class
+    :param n_bins:          The number of quantile bins, e.g. 10 for deciles or 100 for percentiles
+    :param pos_label:       The label of the positive class
+    :return:                A DataFrame with the gain and lift per bin, from the highest bin to the lowest
+    """
+    return BinaryClassifierCurves(y_true, y_pred_proba, pos_label=pos_label).lift_table(n_bins=n_bins)
+
+
+class BinaryClassifierCurves:
+    """
+    Evaluation curves and metrics of a binary classifier, derived from a single sort of the predicted probabilities.
+
+    The predictions are sorted once, after which the ROC and Precision-Recall curves (and their areas), the cumulative
+    precision, the lift deciles, the sorted probabilities and the calibration curves are all derived from cumulative
+    sums over the sorted arrays. The results match those of the corresponding Scikit-Learn functions.
+
+    :param y_true:          The true labels
+    :param y_pred_proba:    The predicted probabilities of the positive class
+    :param pos_label:       The label of the positive class
+    """
+
+    def __init__(self, y_true, y_pred_proba, pos_label=1):
+        y_true = np.asarray(y_true) == pos_label
+        y_score = np.asarray(y_pred_proba, dtype=float)
+
+        # A stable sort in descending order of the probabilities
+        order = np.argsort(-y_score, kind='mergesort')
+        self.y_score = y_score[order]
+        self.y_true = y_true[order]
+        self.n = len(self.y_true)
+
+    @cached_property
+    def cum_true(self):
+        """The number of positives among the top k predictions, for k = 1, ..., n."""
+        return np.cumsum(self.y_true)
+
+    @cached_property
+    def cum_score(self):
+        """The sum of the probabilities of the top k predictions, for k = 1, ..., n."""
+        return np.cumsum(self.y_score)
+
+    @property
+    def n_pos(self):
+        return int(self.cum_true[-1]) if self.n > 0 else 0
+
+    @property
+    def n_neg(self):
+        return self.n - self.n_pos
+
+    @property
+    def min_score(self):
+        return self.y_score[-1]
+
+    @property
+    def max_score(self):
+        return self.y_score[0]
+
+    @cached_property
+    def _threshold_counts(self):
+        # The number of true and false positives at each distinct threshold (cf. sklearn.metrics._binary_clf_curve)
+        threshold_idxs = np.r_[np.flatnonzero(np.diff(self.y_score)), self.n - 1]
+        tps = self.cum_true[threshold_idxs]
+        fps = 1 + threshold_idxs - tps
+        return tps, fps, self.y_score[threshold_idxs]
+
+    def _check_both_classes(self, metric):
+        if self.n_pos == 0 or self.n_neg == 0:
+            raise ValueError(f"Only one class present in y_true. {metric} is not defined in that case.")
+
+    def roc_curve(self, drop_intermediate=True):
+        """Returns fpr, tpr and thresholds, like sklearn.metrics.roc_curve."""
+        tps, fps, thresholds = self._threshold_counts
+        if drop_intermediate and len(fps) > 2:
+            # Drop thresholds that are collinear with their neighbours, they do not change the curve
+            optimal_idxs = np.flatnonzero(np.r_[True, np.logical_or(np.diff(fps, 2), np.diff(tps, 2)), True])
+            tps, fps, thresholds = tps[optimal_idxs], fps[optimal_idxs], thresholds[optimal_idxs]
+        tps = np.r_[0, tps]
+        fps = np.r_[0, fps]
+        thresholds = np.r_[np.inf, thresholds]
+        fpr = fps / fps[-1] if fps[-1] > 0 else np.full(fps.shape, np.nan)
+        tpr = tps / tps[-1] if tps[-1] > 0 else np.full(tps.shape, np.nan)
+        return fpr, tpr, thresholds
+
+    def roc_auc(self):
+        """Returns the area under the ROC curve, like sklearn.metrics.roc_auc_score."""
+        self._check_both_classes("ROC AUC score")
+        fpr, tpr, _ = self.roc_curve(drop_intermediate=False)
+        return float(_trapezoid(fpr, tpr))
+
+    def precision_recall_curve(self):
+        """Returns precision, recall and thresholds, like sklearn.metrics.precision_recall_curve."""
+        tps, fps, thresholds = self._threshold_counts
+        predicted_pos = tps + fps
+        precision = np.divide(tps, predicted_pos, out=np.zeros(tps.shape), where=predicted_pos != 0)
+        recall = tps / tps[-1] if tps[-1] > 0 else np.ones(tps.shape)
+
+        # Stop when full recall is attained, and reverse the outputs so that recall is decreasing
+        last_ind = tps.searchsorted(tps[-1])
+        sl = slice(last_ind, None, -1)
+        return np.r_[precision[sl], 1], np.r_[recall[sl], 0], thresholds[sl]
+
+    def average_precision(self):
+        """Returns the average precision, like sklearn.metrics.average_precision_score."""
+        precision, recall, _ = self.precision_recall_curve()
+        return float(-np.sum(np.diff(recall) * np.array(precision)[:-1]))
+
+    def confusion_counts(self, threshold=0.5):
+        """Returns tp, fp, tn and fn of the labels predicted as positive if their probability exceeds the threshold."""
+        # The number of predictions with a probability above the threshold, using the descending order
+        n_above = int(np.searchsorted(-self.y_score, -threshold, side='left'))
+        tp = int(self.cum_true[n_above - 1]) if n_above > 0 else 0
+        fp = n_above - tp
+        return tp, fp, self.n_neg - fp, self.n_pos - tp
+
+    def classification_metrics(self, threshold=0.5):
+        """
+        Returns the accuracy, f1, precision and recall at the threshold, like the corresponding Scikit-Learn functions
+        (with zero_division=0).
+        """
+        tp, fp, tn, fn = self.confusion_counts(threshold)
+        return {
+            'accuracy': (tp + tn) / self.n if self.n > 0 else 0.,
+            'f1': 2 * tp / (2 * tp + fp + fn) if tp > 0 else 0.,
+            'precision': tp / (tp + fp) if tp > 0 else 0.,
+            'recall': tp / (tp + fn) if tp > 0 else 0.,
+        }
+
+    def _cutoffs(self, thresholds):
+        # The cut-offs above which exactly the predictions with a probability of at least the threshold are positive,
+        # halfway to the next lower threshold
+        if len(thresholds) == 0:
+            return thresholds
+        return np.r_[(thresholds[:-1] + thresholds[1:]) / 2, np.nextafter(thresholds[-1], -np.inf)]
+
+    def threshold_sweep(self, utility=None):
+        """
+        Returns the confusion matrix and metrics at every distinct threshold, from the single sort of the predictions.
+
+        Each row contains the counts and metrics of the labels predicted as positive if their probability exceeds the
+        threshold (e.g. with myautoml.evaluation.prediction.predict_labels). The first row predicts no positives, the
+        last row predicts all positives. The utility is the sum of the counts weighted by the utility dict, with keys
+        'tp', 'fp', 'tn' and 'fn' (see DEFAULT_UTILITY), e.g. the profit of each true positive and the (negative)
+        cost of each false positive.
+
+        :param utility: A dict with the weights of the counts in the utility, or None to use DEFAULT_UTILITY
+        :return:        A DataFrame with the threshold, tp, fp, tn, fn, accuracy, precision, recall, f1 and utility
+        """
+        utility = {**DEFAULT_UTILITY, **(utility or {})}
+        tps, fps, thresholds = self._threshold_counts
+        tp = np.r_[0, tps].astype(np.int64)
+        fp = np.r_[0, fps].astype(np.int64)
+        tn = self.n_neg - fp
+        fn = self.n_pos - tp
+        with np.errstate(invalid='ignore', divide='ignore'):
+            table = pd.DataFrame({
+                'threshold': np.r_[self.max_score, self._cutoffs(np.asarray(thresholds, dtype=float))],
+                'tp': tp,
+                'fp': fp,
+                'tn': tn,
+                'fn': fn,
+                'accuracy': (tp + tn) / self.n,
+                'precision': np.where(tp > 0, tp / np.maximum(tp + fp, 1), 0.),
+                'recall': np.where(tp > 0, tp / max(self.n_pos, 1), 0.),
+                'f1': np.where(tp > 0, 2 * tp / np.maximum(2 * tp + fp + fn, 1), 0.),
+            })
+        table['utility'] = (utility['tp'] * tp + utility['fp'] * fp + utility['tn'] * tn + utility['fn'] * fn)
+        return table
+
+    def optimal_threshold(self, objective='f1', utility=None):
+        """
+        Returns the threshold that maximises the objective, and the value of the objective at that threshold.
+
+        :param objective:   The column of the threshold sweep to maximise, e.g. 'f1', 'accuracy' or 'utility'
+        :param utility:     The weights of the utility (see threshold_sweep)
+        :return:            The threshold and the value of the objective
+        """
+        table = self.threshold_sweep(utility=utility)
+        if objective not in table.columns or objective in ('threshold', 'tp', 'fp', 'tn', 'fn'):
+            raise ValueError(f"Invalid objective: {objective!r}. Expected one of 'accuracy', 'precision', 'recall', "
+                             f"'f1' or 'utility'.")
+        best = int(np.argmax(table[objective].to_numpy()))
+        return float(table['threshold'].iloc[best]), float(table[objective].iloc[best])
+
+    def cum_precision(self):
+        """Returns the fraction of the population and the precision among the top predictions of that fraction."""
+        rank = np.arange(1, self.n + 1)
+        return rank / self.n, self.cum_true / rank
+
+    def sorted_probabilities(self, ascending=True):
+        """Returns the fraction of the population and the sorted probabilities."""
+        fraction = np.arange(1, self.n + 1) / self.n
+        return fraction, (self.y_score[::-1] if ascending else self.y_score)
+
+    def prediction_histogram(self, n_bins=20, range=None):
+        """Returns the counts and edges of a histogram of the probabilities, like numpy.histogram."""
+        return np.histogram(self.y_score, bins=n_bins, range=range)
+
+    def _bin_counts(self, edges, right):
+        """
+        Returns the number of predictions, positives and the sum of the probabilities in the bins between the
+        (ascending) edges. The bins are closed on the right if right is True, and on the left otherwise. Values
+        outside of the edges are not counted.
+        """
+        # The number of predictions with a probability above (or at) each edge, using the descending order
+        side = 'left' if right else 'right'
+        n_above = np.searchsorted(self._neg_score, -np.asarray(edges), side=side)
+        cum_true, cum_score = self._padded_cum_sums
+        counts = -np.diff(n_above)
+        positives = -np.diff(cum_true[n_above])
+        score_sums = -np.diff(cum_score[n_above])
+        return counts, positives, score_sums
+
+    @cached_property
+    def _neg_score(self):
+        # The negated probabilities are in ascending order, so they can be searched with np.searchsorted
+        return -self.y_score
+
+    @cached_property
+    def _padded_cum_sums(self):
+        return np.r_[0, self.cum_true], np.r_[0., self.cum_score]
+
+    def _quantile_bins(self, n_bins):
+        """
+        Returns the (ascending) edges of the quantile bins of the probabilities, and the number of predictions,
+        positives and the sum of the probabilities in each bin, like pandas.qcut(y_pred_proba, n_bins,
+        duplicates='drop').
+        """
+        edges = np.unique(sorted_quantiles(self.y_score[::-1], np.linspace(0, 1, n_bins + 1)))
+        # The bins are closed on the right, and the lowest bin also includes its left edge
+        edges[0] = np.nextafter(edges[0], -np.inf)
+        return (edges, *self._bin_counts(edges, right=True))
+
+    def lift_deciles(self, n_bins=10):
+        """
+        Returns the (non-cumulative) lift of each quantile bin of the probabilities, from the highest bin to the
+        lowest, like a groupby over pandas.qcut(y_pred_proba, n_bins, duplicates='drop').
+        """
+        baseline = self.n_pos / self.n
+        _, counts, positives, _ = self._quantile_bins(n_bins)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            lift = positives / counts / baseline
+        return np.flip(lift)
+
+    def lift_table(self, n_bins=10):
+        """
+        Returns the gain and lift table of the quantile bins of the probabilities (e.g. deciles or percentiles), from
+        the highest bin to the lowest.
+
+        :param n_bins:  The number of quantile bins (bins with duplicate edges are dropped, like pandas.qcut, and so
+                        are empty bins)
+        :return:        A DataFrame with per bin: the probability range, the number of predictions and positives, the
+                        positive rate and lift, and the cumulative fraction of the population, gain (the fraction of
+                        all positives) and lift
+        """
+        edges, counts, positives, _ = self._quantile_bins(n_bins)
+        nonempty = counts > 1e-9
+        lower, upper = np.maximum(edges[:-1], self.min_score)[nonempty], edges[1:][nonempty]
+        baseline = self.n_pos / self.n
+        counts, positives = np.flip(counts[nonempty]), np.flip(positives[nonempty])
+        cum_counts, cum_positives = np.cumsum(counts), np.cumsum(positives)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return pd.DataFrame({
+                'bin': np.arange(1, len(counts) + 1),
+                'min_probability': np.flip(lower),
+                'max_probability': np.flip(upper),
+                'count': counts,
+                'positives': positives,
+                'positive_rate': positives / counts,
+                'lift': positives / counts / baseline,
+                'cum_fraction': cum_counts / self.n,
+                'cum_positives': cum_positives,
+                'gain': cum_positives / self.n_pos,
+                'cum_lift': cum_positives / cum_counts / baseline,
+            })
+
+    def calibration_curve(self, n_bins=20, strategy='uniform'):
+        """Returns the fraction of positives and the mean predicted value per bin, like sklearn's calibration_curve."""
+        if strategy == 'quantile':
+            edges = sorted_quantiles(self.y_score[::-1], np.linspace(0, 1, n_bins + 1))
+            edges[-1] = edges[-1] + 1e-8
+        elif strategy == 'uniform':
+            edges = np.linspace(0., 1. + 1e-8, n_bins + 1)
+        else:
+            raise ValueError("Invalid entry to 'strategy' input. Strategy must be either 'quantile' or 'uniform'.")
+        counts, positives, score_sums = self._bin_counts(edges, right=False)
+        nonzero = counts != 0
+        return positives[nonzero] / counts[nonzero], score_sums[nonzero] / counts[nonzero]
@@ -0,0 +1,70 @@
+import logging
+
+from joblib import Parallel, delayed
+import numpy as np
+import pandas as pd
+
+_logger = logging.getLogger(__name__)
+
+
+def _slice_rows(x, start, stop):
+    if isinstance(x, (pd.DataFrame, pd.Series)):
+        return x.iloc[start:stop]
+    return x[start:stop]
+
+
+def _take_rows(x, indices):
+    if isinstance(x, (pd.DataFrame, pd.Series)):
+        return x.iloc[indices]
+    return x[indices]
+
+
+def _predict_proba_chunk(model, x):
+    return np.ascontiguousarray(model.predict_proba(x)[:, 1])
+
+
+def predict_proba(model, x, chunk_size=None, n_jobs=None, backend='threading'):
+    """
+    Predicts the probabilities of the positive class, in chunks of rows.
+
+    Predicting in chunks keeps the peak memory of the intermediate results of the model bounded by the chunk size,
+    instead of growing with the number of rows in x. The chunks can be predicted in parallel.
+
+    :param model:       The (fitted) binary classifier
+    :param x:           The data to predict, a DataFrame, array or sparse matrix
+    :param chunk_size:  The maximum number of rows per chunk, or None to predict all rows at once
+    :param n_jobs:      The number of parallel jobs to predict the chunks with (see joblib.Parallel)
+    :param backend:     The joblib backend, e.g. 'threading' (most estimators release the GIL while predicting)
+                        or 'loky' for a process pool
+    :return:            A 1-dimensional array with the predicted probabilities of the positive class
+    """
+    n_rows = x.shape[0]
+    if chunk_size is None or n_rows <= chunk_size:
+        return _predict_proba_chunk(model, x)
+
+    bounds = [(start, min(start + chunk_size, n_rows)) for start in range(0, n_rows, chunk_size)]
+    _logger.debug(f"Predicting {n_rows} rows in {len(bounds)} chunks (n_jobs={n_jobs})")
+    if n_jobs is None or n_jobs == 1:
+        y_pred_proba = np.empty(n_rows)
+        for start, stop in bounds:
+            y_pred_proba[start:stop] = _predict_proba_chunk(model, _slice_rows(x, start, stop))
+        return y_pred_proba
+
+    chunks = Parallel(n_jobs=n_jobs, backend=backend)(
+        delayed(_predict_proba_chunk)(model, _slice_rows(x, start, stop)) for start, stop in bounds)
+    return np.concatenate(chunks)
+
+
+def predict_labels(model, y_pred_proba, threshold=0.5):
+    """
+    Derives the predicted labels from the predicted probabilities of the positive class.
+
+    A row is predicted as the positive class if its probability exceeds the threshold. With the default threshold of
+    0.5, this gives the same labels as model.predict, without running the model a second time.
+
+    :param model:           The (fitted) binary classifier, of which the classes_ are used as labels
+    :param y_pred_proba:    The predicted probabilities of the positive class
+    :param threshold:       The probability threshold
+    :return:                An array with the predicted labels
+    """
+    return np.asarray(model.classes_)[(np.asarray(y_pred_proba) > threshold).astype(int)]
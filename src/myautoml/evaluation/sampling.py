@@ -0,0 +1,41 @@
+import numpy as np
+
+
+def _get_n_rows(size, n_rows):
+    # The size is either a number of rows or a fraction of the rows
+    if size is None:
+        return n_rows
+    if isinstance(size, float) and 0 < size <= 1:
+        return max(1, int(round(size * n_rows)))
+    return min(int(size), n_rows)
+
+
+def sample_rows(n_rows, size, y=None, random_state=None, exclude=None):
+    """
+    Draws a random sample of row indices, stratified by y if it is given.
+
+    :param n_rows:          The number of rows to sample from
+    :param size:            The number of rows, or the fraction of the rows (a float in (0, 1]) to sample
+    :param y:               Optional labels to stratify the sample by
+    :param random_state:    The seed or numpy Generator
+    :param exclude:         Optional row indices that are not sampled, e.g. the rows of another sample
+    :return:                The sorted indices of the sampled rows
+    """
+    rng = np.random.default_rng(random_state)
+    candidates = np.arange(n_rows) if exclude is None else np.setdiff1d(np.arange(n_rows), exclude)
+    size = min(_get_n_rows(size, n_rows), len(candidates))
+    if size == len(candidates):
+        return candidates
+    if y is None:
+        return np.sort(rng.choice(candidates, size=size, replace=False))
+
+    # Allocates the sample to the classes in proportion to their size, with the largest remainders rounded up
+    classes, y_candidates = np.unique(np.asarray(y)[candidates], return_inverse=True)
+    class_counts = np.bincount(y_candidates, minlength=len(classes))
+    quotas = class_counts / len(candidates) * size
+    allocation = np.floor(quotas).astype(int)
+    remainders = np.argsort(allocation - quotas, kind='stable')[:size - allocation.sum()]
+    allocation[remainders] += 1
+    sample = [rng.choice(candidates[y_candidates == i], size=allocation[i], replace=False)
+              for i in range(len(classes))]
+    return np.sort(np.concatenate(sample))
@@ -1,7 +1,12 @@
 import logging
 
+import numpy as np
+from scipy.stats import spearmanr
 import shap
 
+from myautoml.evaluation.prediction import _take_rows
+from myautoml.evaluation.sampling import sample_rows
+from myautoml.evaluation.shap_values import get_shap_values, to_dense
 from myautoml.utils.sklearn import get_ct_feature_names
 from myautoml.visualisation.evaluation.shap import (
     save_shap_summary, save_shap_dependence_plots, save_shap_summary_bar)
@@ -9,27 +14,110 @@ from myautoml.visualisation.evaluation.shap import (
 _logger = logging.getLogger(__name__)
 
 
-def shap_analyse(model, x, temp_dir, return_shap_details=False, ignore_plot_errors=False):
+def shap_rank_stability(shap_values, random_state=None):
+    """
+    Estimates the stability of the ranking of the features by mean absolute SHAP value at the sample size.
+
+    The sample is split in two random halves, and the Spearman correlation between the mean absolute SHAP values of
+    both halves is corrected to the full sample size with the Spearman-Brown formula. Values close to 1 indicate that
+    a larger sample would not change the ranking.
+
+    :param shap_values:     The SHAP values of the positive class, of the sample
+    :param random_state:    The seed or numpy Generator to split the sample with
+    :return:                The estimated rank stability, or NaN if it cannot be estimated
+    """
+    n_rows, n_features = shap_values.shape
+    if n_rows < 4 or n_features < 2:
+        return np.nan
+    rng = np.random.default_rng(random_state)
+    half = rng.permutation(n_rows) < n_rows // 2
+    importance = np.abs(shap_values)
+    correlation = spearmanr(importance[half].mean(axis=0), importance[~half].mean(axis=0)).correlation
+    if not np.isfinite(correlation):
+        return np.nan
+    return float(2 * correlation / (1 + correlation)) if correlation > -1 else -1.
+
+
+def shap_analyse(model, x, temp_dir, return_shap_details=False, ignore_plot_errors=False, y=None, sample_size=None,
+                 background_size=None, random_state=None, n_jobs=None, chunk_size=None, dependence_features=None,
+                 dependence_top_k=None, cache=False):
+    """
+    Performs the Shap analysis of a pipeline of a preprocessor and a tree based estimator, and saves the Shap plots.
+
+    The SHAP values can be computed on a (stratified) random sample of the rows of x, so that the analysis takes the
+    same time regardless of the size of x. The estimated stability of the feature ranking at that sample size is
+    added as the tag 'shap_rank_stability' (see shap_rank_stability). If background_size is set, the SHAP values are
+    computed with the interventional method, relative to a separate background sample of the rows. Sparse output of
+    the preprocessor is kept sparse, and only densified per chunk of rows or per plotted column.
+
+    :param model:               The pipeline
+    :param x:                   The (unprocessed) data
+    :param temp_dir:            The directory to save the plots in
+    :param return_shap_details: Boolean indicator to also return the explainer, data, SHAP values and feature names
+    :param ignore_plot_errors:  Boolean indicator to log errors of the dependence plots, instead of raising them
+    :param y:                   Optional labels to stratify the samples by
+    :param sample_size:         The number of rows, or the fraction of the rows, to compute the SHAP values of, or None
+                                to use all rows
+    :param background_size:     The number of rows, or the fraction of the rows, of the background sample, or None to
+                                use the tree path dependent method without a background sample
+    :param random_state:        The seed of the samples
+    :param n_jobs:              The number of worker processes to compute the SHAP values and render the dependence
+                                plots with (see myautoml.evaluation.shap_values.compute_shap_values)
+    :param chunk_size:          The number of rows per chunk of the SHAP values
+    :param dependence_features: An optional allow-list of the features to save the dependence plots of
+    :param dependence_top_k:    The number of most important features to save the dependence plots of, or None for
+                                all (allowed) features
+    :param cache:               Boolean indicator to specify whether the SHAP values should be cached (see
+                                myautoml.evaluation.shap_values.get_shap_values)
+    :return:                    The tags and the artifacts
+    """
     temp_dir.mkdir(parents=True, exist_ok=True)
     _logger.debug("Performing Shap analysis")
-    shap_feature_names = get_ct_feature_names(model.steps[0][1])
-
+    rng = np.random.default_rng(random_state)
+    preprocessor = model.steps[0][1]
     shap_estimator = model.steps[1][1]
-    shap_data = model.steps[0][1].transform(x)
+    shap_feature_names = get_ct_feature_names(preprocessor)
+
+    x_all = x
+    n_rows = x_all.shape[0]
+    sample_idx = sample_rows(n_rows, sample_size, y=y, random_state=rng)
+    if len(sample_idx) < n_rows:
+        _logger.debug(f"Computing the Shap values of a sample of {len(sample_idx)} of the {n_rows} rows")
+        x = _take_rows(x_all, sample_idx)
+    shap_data = preprocessor.transform(x)
 
-    shap_explainer = shap.TreeExplainer(shap_estimator)
-    shap_values = shap_explainer.shap_values(shap_data)[1]
+    if background_size is None:
+        background = None
+        shap_explainer = shap.TreeExplainer(shap_estimator)
+    else:
+        # The background sample is drawn from the rows outside of the sample, if there are any
+        background_idx = sample_rows(n_rows, background_size, y=y, random_state=rng,
+                                     exclude=sample_idx if len(sample_idx) < n_rows else None)
+        if len(background_idx) == 0:
+            background_idx = sample_rows(n_rows, background_size, y=y, random_state=rng)
+        _logger.debug(f"Using a background sample of {len(background_idx)} rows")
+        # The background sample is small, so it is densified as a whole
+        background = to_dense(preprocessor.transform(_take_rows(x_all, background_idx)))
+        shap_explainer = shap.TreeExplainer(shap_estimator, data=background, feature_perturbation='interventional')
+    shap_values = get_shap_values(shap_explainer, shap_data, n_jobs=n_jobs, chunk_size=chunk_size, cache=cache)
+    expected_value = np.atleast_1d(shap_explainer.expected_value)[-1]
 
     # Computes the baseline value, i.e. expected average shape value for all customers
     tags = {
-        'shap_expected_value': shap_explainer.expected_value[1]
+        'shap_expected_value': expected_value,
+        'shap_sample_size': len(sample_idx),
+        'shap_background_size': 0 if background_size is None else len(background_idx),
+        'shap_rank_stability': shap_rank_stability(shap_values, random_state=rng),
     }
 
     shap_summary_path = save_shap_summary(temp_dir, shap_values, shap_data, shap_feature_names)
     shap_summary_bar_path = save_shap_summary_bar(temp_dir, shap_values, shap_data, shap_feature_names)
     shap_dependence_paths = save_shap_dependence_plots(temp_dir, shap_values, shap_data, shap_feature_names, x,
-                                                       model.steps[0][1],
-                                                       ignore_plot_errors=ignore_plot_errors)
+                                                       preprocessor,
+                                                       ignore_plot_errors=ignore_plot_errors,
+                                                       features=dependence_features,
+                                                       top_k=dependence_top_k,
+                                                       n_jobs=n_jobs)
 
     paths = [shap_summary_path, shap_summary_bar_path, *shap_dependence_paths]
     artifacts = {path: 'shap' for path in paths}
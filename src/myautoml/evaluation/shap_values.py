@@ -0,0 +1,148 @@
+import logging
+import math
+from pathlib import Path
+import tempfile
+
+import joblib
+from joblib import Parallel, delayed
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from myautoml.utils.cache import cached
+
+_logger = logging.getLogger(__name__)
+
+# The maximum number of bytes of a chunk of sparse data that is densified at once
+DENSE_CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def to_dense(data):
+    """Returns sparse data as a dense array, and other data as is."""
+    return data.toarray() if sparse.issparse(data) else data
+
+
+def dense_columns(data, columns):
+    """Returns the given columns of the data as a dense array, without densifying the other columns."""
+    if isinstance(data, pd.DataFrame):
+        return data.iloc[:, columns].to_numpy()
+    return np.asarray(to_dense(data[:, columns]))
+
+
+def get_positive_class_shap(shap_values, expected_value):
+    """
+    Returns the SHAP values and expected value of the positive class.
+
+    Depending on the version of shap and the estimator, TreeExplainer returns a list with an array per class, a 3D
+    array with the classes in the last dimension, or a single 2D array (e.g. of the log-odds of a gradient boosting
+    classifier).
+    """
+    expected_value = np.atleast_1d(expected_value)
+    if isinstance(shap_values, list):
+        return shap_values[-1], expected_value[-1]
+    if shap_values.ndim == 3:
+        return shap_values[:, :, -1], expected_value[-1]
+    return shap_values, expected_value[-1]
+
+
+def _explain_rows(explainer, data):
+    # Sparse data is only densified per chunk of rows
+    shap_values, _ = get_positive_class_shap(explainer.shap_values(to_dense(data)), explainer.expected_value)
+    return shap_values
+
+
+# The explainers loaded by the worker processes, by path, so that each worker loads an explainer only once
+_loaded_explainers = {}
+
+
+def _shap_values_chunk(explainer_path, data_path, start, stop):
+    explainer_path = str(explainer_path)
+    if explainer_path not in _loaded_explainers:
+        _loaded_explainers.clear()
+        _loaded_explainers[explainer_path] = joblib.load(explainer_path, mmap_mode='r')
+    explainer = _loaded_explainers[explainer_path]
+    data = joblib.load(data_path, mmap_mode='r')
+    return _explain_rows(explainer, data[start:stop])
+
+
+def compute_shap_values(explainer, data, n_jobs=None, chunk_size=None):
+    """
+    Computes the SHAP values of the positive class, optionally in chunks of rows in parallel worker processes.
+
+    The explainer (with the fitted estimator) and the data are dumped once to temporary files, which the workers
+    memory-map, instead of pickling them for every chunk. The chunks are reassembled in the order of the rows.
+
+    Sparse data (e.g. the one-hot encoded output of a ColumnTransformer) is kept sparse, and only densified per chunk of
+    rows, also in this process. By default, the chunks of sparse data are limited to DENSE_CHUNK_BYTES when densified.
+
+    :param explainer:   The shap explainer, e.g. a shap.TreeExplainer
+    :param data:        The (preprocessed) data to compute the SHAP values of
+    :param n_jobs:      The number of worker processes (see joblib.Parallel), or None to compute them in this process
+    :param chunk_size:  The number of rows per chunk, or None to split the rows in 4 chunks per worker (and in chunks
+                        of at most DENSE_CHUNK_BYTES if the data is sparse)
+    :return:            The SHAP values of the positive class
+    """
+    n_rows, n_features = data.shape
+    n_workers = joblib.effective_n_jobs(n_jobs) if n_jobs is not None else 1
+    if chunk_size is None and sparse.issparse(data):
+        chunk_size = max(1, DENSE_CHUNK_BYTES // (8 * max(n_features, 1)))
+        if n_workers > 1:
+            chunk_size = min(chunk_size, math.ceil(n_rows / (4 * n_workers)))
+    if n_rows < 2 or (n_workers == 1 and (chunk_size is None or chunk_size >= n_rows)):
+        return _explain_rows(explainer, data)
+
+    if chunk_size is None:
+        chunk_size = math.ceil(n_rows / (4 * n_workers))
+    bounds = [(start, min(start + chunk_size, n_rows)) for start in range(0, n_rows, chunk_size)]
+    if n_workers == 1:
+        _logger.debug(f"Computing the Shap values of {n_rows} rows in {len(bounds)} chunks")
+        # The chunks are written into the result, so that the SHAP values are not held twice
+        shap_values = None
+        for start, stop in bounds:
+            chunk = _explain_rows(explainer, data[start:stop])
+            if shap_values is None:
+                shap_values = np.empty((n_rows, *chunk.shape[1:]), dtype=chunk.dtype)
+            shap_values[start:stop] = chunk
+        return shap_values
+
+    _logger.debug(f"Computing the Shap values of {n_rows} rows in {len(bounds)} chunks (n_jobs={n_jobs})")
+    with tempfile.TemporaryDirectory(prefix='myautoml-shap-') as td:
+        explainer_path = Path(td) / 'explainer.joblib'
+        data_path = Path(td) / 'data.joblib'
+        joblib.dump(explainer, explainer_path)
+        joblib.dump(data, data_path)
+        chunks = Parallel(n_jobs=n_jobs)(
+            delayed(_shap_values_chunk)(explainer_path, data_path, start, stop) for start, stop in bounds)
+    return np.concatenate(chunks)
+
+
+def _explainer_key(explainer):
+    # The model of the explainer is derived from the fitted estimator (e.g. the trees of a TreeExplainer), and its data
+    # is the background sample, so two explainers with equal keys compute the same SHAP values
+    return (f"{type(explainer).__module__}.{type(explainer).__qualname__}", getattr(explainer, 'model_output', None),
+            getattr(explainer, 'feature_perturbation', None), getattr(explainer, 'data', None), explainer.model)
+
+
+def get_shap_values(explainer, data, n_jobs=None, chunk_size=None, cache=False):
+    """
+    Computes the SHAP values of the positive class (see compute_shap_values), optionally cached.
+
+    If cache is True, the SHAP values are cached (see myautoml.utils.cache.cached), keyed on a fingerprint of the
+    explainer (its type, model output, feature perturbation, background data and model) and the data. They are stored
+    as a .npy file, so on repeat runs with an unchanged model and data, they are loaded memory mapped instead of
+    computed again.
+
+    :param explainer:   The shap explainer, e.g. a shap.TreeExplainer
+    :param data:        The (preprocessed) data to compute the SHAP values of
+    :param n_jobs:      The number of worker processes (see compute_shap_values)
+    :param chunk_size:  The number of rows per chunk (see compute_shap_values)
+    :param cache:       Boolean indicator to specify whether the SHAP values should be cached
+    :return:            The SHAP values of the positive class
+    """
+    if not cache:
+        return compute_shap_values(explainer, data, n_jobs=n_jobs, chunk_size=chunk_size)
+    _logger.debug("Computing the Shap values (cached)")
+    # The number of jobs and the chunk size do not change the result, so they are not part of the key
+    cache_key = ('shap_values', _explainer_key(explainer), data)
+    return cached(compute_shap_values, cache_key=cache_key, hash_code=True)(explainer, data, n_jobs=n_jobs,
+                                                                            chunk_size=chunk_size)
@@ -0,0 +1,163 @@
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from myautoml.visualisation.evaluation import decimate_curve
+
+_logger = logging.getLogger(__name__)
+
+CALIBRATION_BINS = 20
+LIFT_BINS = 10
+HISTOGRAM_BINS = 1000
+# The key of the evaluated plots in the stored file, the keys of the curves are prefixed with the label of the data set
+PLOTS_KEY = 'plots'
+
+
+class StoredCurves:
+    """
+    Evaluation curves of a binary classifier, loaded from arrays that have been stored by save_curves.
+
+    It implements the interface of BinaryClassifierCurves that is used by the plot functions in
+    myautoml.visualisation.evaluation, so the plots can be rendered from the stored arrays, without the predictions.
+    Only the stored resolutions are available: calibration curves with 20 bins, and lift deciles with 10 bins.
+
+    :param arrays:  A dict with the stored arrays of one data set
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.n = int(arrays['n'])
+        self.n_pos = int(arrays['n_pos'])
+        self.min_score = float(arrays['min_score'])
+        self.max_score = float(arrays['max_score'])
+
+    @classmethod
+    def from_curves(cls, curves, max_points=1000):
+        """Computes the arrays to store from curves, with the curves decimated to at most max_points points."""
+        fpr, tpr, _ = curves.roc_curve()
+        precision, recall, _ = curves.precision_recall_curve()
+        fraction, cum_precision = curves.cum_precision()
+        sorted_fraction, sorted_probabilities = curves.sorted_probabilities(ascending=True)
+        histogram, _ = curves.prediction_histogram(n_bins=HISTOGRAM_BINS, range=(0., 1.))
+        arrays = {
+            'n': curves.n,
+            'n_pos': curves.n_pos,
+            'min_score': curves.min_score,
+            'max_score': curves.max_score,
+            'roc_auc': curves.roc_auc(),
+            'average_precision': curves.average_precision(),
+            'lift_deciles': curves.lift_deciles(n_bins=LIFT_BINS),
+            'histogram': histogram,
+        }
+        arrays['roc_fpr'], arrays['roc_tpr'] = decimate_curve(fpr, tpr, max_points)
+        arrays['pr_recall'], arrays['pr_precision'] = decimate_curve(recall, precision, max_points)
+        arrays['cum_precision_fraction'], arrays['cum_precision'] = decimate_curve(fraction, cum_precision,
+                                                                                   max_points)
+        arrays['sorted_fraction'], arrays['sorted_probabilities'] = decimate_curve(sorted_fraction,
+                                                                                   sorted_probabilities, max_points)
+        for strategy in ('uniform', 'quantile'):
+            arrays[f'calibration_{strategy}_true'], arrays[f'calibration_{strategy}_pred'] = curves.calibration_curve(
+                n_bins=CALIBRATION_BINS, strategy=strategy)
+        # Single precision is plenty to draw the curves, and halves the size of the stored arrays
+        return cls({name: np.asarray(values, dtype=np.float32) if np.ndim(values) > 0 else np.asarray(values)
+                    for name, values in arrays.items()})
+
+    @property
+    def n_neg(self):
+        return self.n - self.n_pos
+
+    def roc_curve(self, drop_intermediate=True):
+        return self.arrays['roc_fpr'], self.arrays['roc_tpr'], None
+
+    def roc_auc(self):
+        return float(self.arrays['roc_auc'])
+
+    def precision_recall_curve(self):
+        return self.arrays['pr_precision'], self.arrays['pr_recall'], None
+
+    def average_precision(self):
+        return float(self.arrays['average_precision'])
+
+    def cum_precision(self):
+        return self.arrays['cum_precision_fraction'], self.arrays['cum_precision']
+
+    def sorted_probabilities(self, ascending=True):
+        fraction, probabilities = self.arrays['sorted_fraction'], self.arrays['sorted_probabilities']
+        if ascending:
+            return fraction, probabilities
+        return 1 - fraction[::-1] + 1 / self.n, probabilities[::-1]
+
+    def prediction_histogram(self, n_bins=20, range=None):
+        if range is None:
+            range = (self.min_score, self.max_score)
+        # Re-bins the stored histogram, linearly interpolated within its bins
+        edges = np.linspace(range[0], range[1], n_bins + 1)
+        cum_counts = np.r_[0, np.cumsum(self.arrays['histogram'])]
+        stored_edges = np.linspace(0., 1., len(cum_counts))
+        return np.diff(np.interp(edges, stored_edges, cum_counts)), edges
+
+    def lift_deciles(self, n_bins=10):
+        if n_bins != LIFT_BINS:
+            raise ValueError(f"Only the lift deciles with {LIFT_BINS} bins are stored, not {n_bins}")
+        return self.arrays['lift_deciles']
+
+    def calibration_curve(self, n_bins=20, strategy='uniform'):
+        if n_bins != CALIBRATION_BINS:
+            raise ValueError(f"Only the calibration curves with {CALIBRATION_BINS} bins are stored, not {n_bins}")
+        if strategy not in ('uniform', 'quantile'):
+            raise ValueError("Invalid entry to 'strategy' input. Strategy must be either 'quantile' or 'uniform'.")
+        return self.arrays[f'calibration_{strategy}_true'], self.arrays[f'calibration_{strategy}_pred']
+
+
+def save_curves(save_dir, data, max_points=1000, plots=None):
+    """
+    Saves the evaluation curves of all data sets as one compressed .npz file, of typically tens of kilobytes.
+
+    :param save_dir:    The directory to save the file in
+    :param data:        The data sets, with the curves computed by get_metrics
+    :param max_points:  The maximum number of points per curve (see myautoml.visualisation.evaluation.decimate_curve)
+    :param plots:       The plots the data sets are evaluated with, which are rendered by default (see
+                        myautoml.evaluation.binary_classifier.render_curves)
+    :return:            The path of the file, or None if the curves could not be saved
+    """
+    _logger.debug("Saving the evaluation curves")
+    save_path = Path(save_dir) / 'curves.npz'
+    try:
+        arrays = {} if plots is None else {PLOTS_KEY: np.asarray(list(plots), dtype=str)}
+        for label in data.keys():
+            stored_curves = StoredCurves.from_curves(data[label]['curves'], max_points=max_points)
+            arrays.update({f"{label}/{name}": values for name, values in stored_curves.arrays.items()})
+        np.savez_compressed(save_path, **arrays)
+    except Exception as e:
+        _logger.warning(f"Error saving the evaluation curves: {str(e)}")
+        save_path = None
+    return save_path
+
+
+def load_curves(path):
+    """
+    Loads the evaluation curves saved by save_curves.
+
+    :param path:    The path of the .npz file
+    :return:        A dict with the StoredCurves of each data set
+    """
+    arrays = {}
+    with np.load(path) as f:
+        for key in f.files:
+            if key == PLOTS_KEY:
+                continue
+            label, name = key.split('/', 1)
+            arrays.setdefault(label, {})[name] = f[key]
+    return {label: StoredCurves(label_arrays) for label, label_arrays in arrays.items()}
+
+
+def load_curves_plots(path):
+    """
+    Loads the plots that the curves saved by save_curves have been evaluated with.
+
+    :param path:    The path of the .npz file
+    :return:        The list of plots, or None if they have not been saved
+    """
+    with np.load(path) as f:
+        return f[PLOTS_KEY].tolist() if PLOTS_KEY in f.files else None
@@ -0,0 +1,219 @@
+import logging
+
+import numpy as np
+
+from myautoml.evaluation.curves import BinaryClassifierCurves
+from myautoml.evaluation.prediction import predict_proba
+
+_logger = logging.getLogger(__name__)
+
+
+class StreamingBinaryClassifierCurves(BinaryClassifierCurves):
+    """
+    Evaluation curves and metrics of a binary classifier, accumulated chunk by chunk in fixed-resolution histograms.
+
+    Instead of keeping (and sorting) all predictions, the number of positives, negatives and the sum of the
+    probabilities are counted in n_bins equal-width bins of the probabilities, closed on the right. The memory usage
+    does not depend on the number of predictions, and accumulators of different chunks or workers can be merged.
+
+    The curves and metrics are those of the predictions rounded up to the bin edges: predictions within the same bin
+    are treated as ties. The ROC AUC and average precision therefore differ from the exact values by at most the
+    fraction of (positive, negative) pairs that fall in the same bin. The confusion counts are exact for thresholds
+    on the bin edges, i.e. multiples of 1 / n_bins (like the default threshold of 0.5), and linearly interpolated
+    within the bins otherwise. The quantile based lift deciles and calibration bins are interpolated within the bins.
+
+    It implements the interface of BinaryClassifierCurves, so it can be passed as curves to the plot functions in
+    myautoml.visualisation.evaluation.
+
+    Example:
+        curves = StreamingBinaryClassifierCurves()
+        for y_chunk, y_pred_proba_chunk in chunks:
+            curves.update(y_chunk, y_pred_proba_chunk)
+        roc_auc = curves.roc_auc()
+
+    :param n_bins:      The number of bins of the probabilities, i.e. the resolution of the histograms
+    :param pos_label:   The label of the positive class
+    """
+
+    def __init__(self, n_bins=10000, pos_label=1):
+        self.n_bins = n_bins
+        self.pos_label = pos_label
+        self.edges = np.linspace(0., 1., n_bins + 1)
+        self.pos_counts = np.zeros(n_bins, dtype=np.int64)
+        self.neg_counts = np.zeros(n_bins, dtype=np.int64)
+        self.score_sums = np.zeros(n_bins)
+        self._min_score = np.inf
+        self._max_score = -np.inf
+
+    def update(self, y_true, y_pred_proba):
+        """Adds a chunk of true labels and predicted probabilities of the positive class."""
+        y_true = np.asarray(y_true) == self.pos_label
+        y_score = np.asarray(y_pred_proba, dtype=float)
+        if len(y_score) == 0:
+            return self
+
+        # Bin i contains the probabilities in (edges[i], edges[i + 1]], values outside of [0, 1] are clipped
+        bins = np.clip(np.searchsorted(self.edges, y_score, side='left') - 1, 0, self.n_bins - 1)
+        self.pos_counts += np.bincount(bins[y_true], minlength=self.n_bins)
+        self.neg_counts += np.bincount(bins[~y_true], minlength=self.n_bins)
+        self.score_sums += np.bincount(bins, weights=y_score, minlength=self.n_bins)
+        self._min_score = min(self._min_score, float(y_score.min()))
+        self._max_score = max(self._max_score, float(y_score.max()))
+        return self
+
+    def merge(self, other):
+        """Adds the counts of another accumulator, e.g. of another chunk or worker, to this one."""
+        if other.n_bins != self.n_bins or other.pos_label != self.pos_label:
+            raise ValueError(f"Cannot merge accumulators with different n_bins or pos_label: "
+                             f"({self.n_bins}, {self.pos_label!r}) and ({other.n_bins}, {other.pos_label!r})")
+        self.pos_counts += other.pos_counts
+        self.neg_counts += other.neg_counts
+        self.score_sums += other.score_sums
+        self._min_score = min(self._min_score, other._min_score)
+        self._max_score = max(self._max_score, other._max_score)
+        return self
+
+    def copy(self):
+        result = StreamingBinaryClassifierCurves(n_bins=self.n_bins, pos_label=self.pos_label)
+        return result.merge(self)
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    @property
+    def counts(self):
+        return self.pos_counts + self.neg_counts
+
+    @property
+    def n(self):
+        return int(self.pos_counts.sum() + self.neg_counts.sum())
+
+    @property
+    def n_pos(self):
+        return int(self.pos_counts.sum())
+
+    @property
+    def min_score(self):
+        return self._min_score
+
+    @property
+    def max_score(self):
+        return self._max_score
+
+    @property
+    def _threshold_counts(self):
+        # The number of true and false positives above the lower edge of each non-empty bin, from the highest bin down
+        nonempty = np.flatnonzero(self.counts[::-1])
+        tps = np.cumsum(self.pos_counts[::-1])[nonempty]
+        fps = np.cumsum(self.neg_counts[::-1])[nonempty]
+        return tps, fps, self.edges[:-1][::-1][nonempty]
+
+    def _cutoffs(self, thresholds):
+        # The bins are closed on the right, so the lower edges of the bins are the exact cut-offs, except for the
+        # lowest bin, which also contains the probabilities at (or clipped to) its lower edge
+        if len(thresholds) == 0:
+            return thresholds
+        return np.r_[thresholds[:-1], min(thresholds[-1], np.nextafter(self.min_score, -np.inf))]
+
+    def _counts_above(self, thresholds):
+        """
+        Returns the number of predictions, positives and the sum of the probabilities above the thresholds,
+        linearly interpolated within the bins.
+        """
+        thresholds = np.asarray(thresholds, dtype=float)
+        results = []
+        for values in (self.counts, self.pos_counts, self.score_sums):
+            above = np.r_[np.cumsum(values[::-1])[::-1], 0]
+            results.append(np.interp(thresholds, self.edges, above))
+        return tuple(results)
+
+    def _quantiles(self, q):
+        """Returns quantiles of the probabilities, linearly interpolated within the bins."""
+        cum_counts = np.r_[0, np.cumsum(self.counts)]
+        # The rank of each quantile, at least a small positive number so that it falls in a non-empty bin
+        ranks = np.maximum(np.asarray(q, dtype=float) * self.n, 1e-9)
+        bins = np.minimum(np.searchsorted(cum_counts[1:], ranks, side='left'), self.n_bins - 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            within = np.nan_to_num((ranks - cum_counts[bins]) / self.counts[bins])
+        quantiles = self.edges[bins] + np.clip(within, 0, 1) / self.n_bins
+        return np.clip(quantiles, self.min_score, self.max_score)
+
+    def confusion_counts(self, threshold=0.5):
+        position = threshold * self.n_bins
+        if np.isclose(position, np.round(position)):
+            # The threshold is on a bin edge, so the counts are exact
+            k = int(np.clip(np.round(position), 0, self.n_bins))
+            predicted_pos = int(self.counts[k:].sum())
+            tp = int(self.pos_counts[k:].sum())
+        else:
+            predicted_pos, tp, _ = (float(v) for v in self._counts_above(threshold))
+        fp = predicted_pos - tp
+        return tp, fp, self.n_neg - fp, self.n_pos - tp
+
+    def cum_precision(self):
+        tps, fps, _ = self._threshold_counts
+        predicted_pos = tps + fps
+        return predicted_pos / self.n, tps / predicted_pos
+
+    def sorted_probabilities(self, ascending=True):
+        nonempty = np.flatnonzero(self.counts)
+        counts = self.counts[nonempty]
+        mean_scores = self.score_sums[nonempty] / counts
+        if ascending:
+            return np.cumsum(counts) / self.n, mean_scores
+        return np.cumsum(counts[::-1]) / self.n, mean_scores[::-1]
+
+    def prediction_histogram(self, n_bins=20, range=None):
+        if range is None:
+            range = (self.min_score, self.max_score)
+        hist_edges = np.linspace(range[0], range[1], n_bins + 1)
+        counts_above, _, _ = self._counts_above(hist_edges)
+        return -np.diff(counts_above), hist_edges
+
+    def _bin_stats(self, bin_edges):
+        counts_above, positives_above, score_sums_above = self._counts_above(bin_edges)
+        return -np.diff(counts_above), -np.diff(positives_above), -np.diff(score_sums_above)
+
+    def _quantile_bins(self, n_bins):
+        bin_edges = np.unique(self._quantiles(np.linspace(0, 1, n_bins + 1)))
+        # The lowest bin includes its left edge
+        bin_edges[0] = np.nextafter(bin_edges[0], -np.inf)
+        return (bin_edges, *self._bin_stats(bin_edges))
+
+    def calibration_curve(self, n_bins=20, strategy='uniform'):
+        if strategy == 'quantile':
+            bin_edges = self._quantiles(np.linspace(0, 1, n_bins + 1))
+            bin_edges[0] = np.nextafter(bin_edges[0], -np.inf)
+        elif strategy == 'uniform':
+            bin_edges = np.linspace(0., 1., n_bins + 1)
+            bin_edges[0] = np.nextafter(0., -np.inf)
+        else:
+            raise ValueError("Invalid entry to 'strategy' input. Strategy must be either 'quantile' or 'uniform'.")
+        counts, positives, score_sums = self._bin_stats(bin_edges)
+        nonzero = counts > 1e-9
+        return positives[nonzero] / counts[nonzero], score_sums[nonzero] / counts[nonzero]
+
+
+def accumulate_predictions(model, batches, n_bins=10000, pos_label=1, chunk_size=None, n_jobs=None):
+    """
+    Predicts the probabilities of batches of data, and accumulates them in a StreamingBinaryClassifierCurves.
+
+    Only one batch is in memory at a time, so the batches can be read lazily, e.g. from a generator that reads the
+    data set from disk in parts.
+
+    :param model:       The (fitted) binary classifier
+    :param batches:     An iterable of (x, y) tuples
+    :param n_bins:      The number of bins of the probabilities (see StreamingBinaryClassifierCurves)
+    :param pos_label:   The label of the positive class
+    :param chunk_size:  The maximum number of rows to predict at once (see myautoml.evaluation.prediction)
+    :param n_jobs:      The number of parallel jobs to predict the chunks with
+    :return:            The StreamingBinaryClassifierCurves
+    """
+    curves = StreamingBinaryClassifierCurves(n_bins=n_bins, pos_label=pos_label)
+    for i, (x, y) in enumerate(batches):
+        _logger.debug(f"Accumulating the predictions of batch {i}")
+        curves.update(y, predict_proba(model, x, chunk_size=chunk_size, n_jobs=n_jobs))
+    return curves
@@ -1,14 +1,28 @@
+import copy
+from functools import partial
 import logging
 import os
 from pathlib import Path
-from pickle import dump, load
 import shutil
+import time
 import uuid
 
-from .pickle import load_pickle, save_pickle
+from .cache_index import CacheIndex
+from .cache_writer import cache_writer
+from .fingerprint import fingerprint, function_fingerprint
+from .lock import FileLock, LockTimeout
+from .memory_cache import MemoryCache
+from .storage import delete_object, load_object, object_size, save_object
 
 _logger = logging.getLogger(__name__)
 
+DEFAULT_MEMORY_BYTES = '512M'
+DEFAULT_LOCK_TIMEOUT = 3600
+DEFAULT_LOCK_STALE_AFTER = 60
+
+# Sentinel for a miss in the memory tier, as None is a valid result
+_MISSING = object()
+
 
 class HashableDict(dict):
     def __hash__(self):
@@ -33,12 +47,16 @@ class CachePaths:
 
     @property
     def index_path(self):
-        return self.cache_dir / 'index'
+        return self.cache_dir / 'index.db'
 
     @property
     def data_dir(self):
         return self.cache_dir / 'data'
 
+    @property
+    def lock_dir(self):
+        return self.cache_dir / 'locks'
+
     def set_cache_dir(self):
         cache_dir = os.getenv("MYAUTOML_CACHE_DIR", default=None)
         if cache_dir is None:
@@ -52,31 +70,230 @@ class CachePaths:
         self._myautoml_cache_dir = cache_dir
 
 
+def _parse_bytes(value):
+    """Parses a number of bytes, optionally with a binary unit suffix, e.g. '512M' or '10GB'."""
+    value = str(value).strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(float(value))
+
+
+# Like CachePaths, the settings are read lazily from environment variables, so that they can be loaded from a .env file
+# The class is instantiated at the bottom of this file.
+class CacheSettings:
+    def __init__(self):
+        self._max_bytes = None
+        self._ttl = None
+        self._memory_bytes = None
+        self._memory_policy = None
+        self._lock_timeout = None
+        self._lock_stale_after = None
+        self._loaded = False
+
+    @property
+    def max_bytes(self):
+        """The maximum total size of the cache in bytes (MYAUTOML_CACHE_MAX_BYTES), or None if unbounded."""
+        if not self._loaded:
+            self.load()
+        return self._max_bytes
+
+    @property
+    def ttl(self):
+        """The maximum age of a cache entry in seconds (MYAUTOML_CACHE_TTL), or None if entries never expire."""
+        if not self._loaded:
+            self.load()
+        return self._ttl
+
+    @property
+    def memory_bytes(self):
+        """The memory budget in bytes of the in-process cache tier (MYAUTOML_CACHE_MEMORY_BYTES), 0 disables it."""
+        if not self._loaded:
+            self.load()
+        return self._memory_bytes
+
+    @property
+    def memory_policy(self):
+        """The eviction policy of the in-process cache tier (MYAUTOML_CACHE_MEMORY_POLICY): 'lru' or 'fifo'."""
+        if not self._loaded:
+            self.load()
+        return self._memory_policy
+
+    @property
+    def lock_timeout(self):
+        """
+        The maximum number of seconds to wait for another process computing the same result
+        (MYAUTOML_CACHE_LOCK_TIMEOUT), or None to wait indefinitely. After the timeout, the result is computed anyway.
+        """
+        if not self._loaded:
+            self.load()
+        return self._lock_timeout
+
+    @property
+    def lock_stale_after(self):
+        """The number of seconds after which a lock without heartbeat is stale (MYAUTOML_CACHE_LOCK_STALE_AFTER)."""
+        if not self._loaded:
+            self.load()
+        return self._lock_stale_after
+
+    def load(self):
+        self.set(max_bytes=os.getenv("MYAUTOML_CACHE_MAX_BYTES", default=None),
+                 ttl=os.getenv("MYAUTOML_CACHE_TTL", default=None),
+                 memory_bytes=os.getenv("MYAUTOML_CACHE_MEMORY_BYTES", default=DEFAULT_MEMORY_BYTES),
+                 memory_policy=os.getenv("MYAUTOML_CACHE_MEMORY_POLICY", default='lru'),
+                 lock_timeout=os.getenv("MYAUTOML_CACHE_LOCK_TIMEOUT", default=DEFAULT_LOCK_TIMEOUT),
+                 lock_stale_after=os.getenv("MYAUTOML_CACHE_LOCK_STALE_AFTER", default=DEFAULT_LOCK_STALE_AFTER))
+        _logger.debug(f"Cache settings: max_bytes={self._max_bytes}, ttl={self._ttl}, "
+                      f"memory_bytes={self._memory_bytes}, memory_policy={self._memory_policy}, "
+                      f"lock_timeout={self._lock_timeout}, lock_stale_after={self._lock_stale_after}")
+
+    def set(self, max_bytes=None, ttl=None, memory_bytes=DEFAULT_MEMORY_BYTES, memory_policy='lru',
+            lock_timeout=DEFAULT_LOCK_TIMEOUT, lock_stale_after=DEFAULT_LOCK_STALE_AFTER):
+        """Sets the cache limits explicitly, overriding the environment variables."""
+        self._max_bytes = None if max_bytes is None else _parse_bytes(max_bytes)
+        self._ttl = None if ttl is None else float(ttl)
+        self._memory_bytes = _parse_bytes(memory_bytes)
+        self._memory_policy = memory_policy
+        self._lock_timeout = None if lock_timeout is None else float(lock_timeout)
+        self._lock_stale_after = float(lock_stale_after)
+        self._loaded = True
+
+
+_cache_indices = {}
+_memory_caches = {}
+
+
 def get_cache_index():
-    if cache_paths.index_path.exists():
-        with open(cache_paths.index_path, 'rb') as index_file:
-            cache_index = load(index_file)
-    else:
-        cache_index = {}
-    return cache_index
+    """Returns the (shared) CacheIndex of the current cache dir."""
+    index_path = cache_paths.index_path
+    if index_path not in _cache_indices:
+        _cache_indices[index_path] = CacheIndex(index_path)
+    return _cache_indices[index_path]
+
+
+def get_memory_cache():
+    """Returns the in-process MemoryCache of the current cache dir, configured with the current cache settings."""
+    cache_dir = cache_paths.cache_dir
+    if cache_dir not in _memory_caches:
+        _memory_caches[cache_dir] = MemoryCache(cache_settings.memory_bytes, cache_settings.memory_policy)
+    memory_cache = _memory_caches[cache_dir]
+    if (memory_cache.max_bytes, memory_cache.policy) != (cache_settings.memory_bytes, cache_settings.memory_policy):
+        memory_cache.configure(cache_settings.memory_bytes, cache_settings.memory_policy)
+    return memory_cache
 
 
-def _save_cache_index(cache_index):
-    cache_paths.index_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(cache_paths.index_path, 'wb') as index_file:
-        dump(cache_index, index_file)
+def close_cache():
+    """Waits for the background cache writes, and closes the cache index and memory tier of the current cache dir."""
+    cache_writer.flush()
+    cache_index = _cache_indices.pop(cache_paths.index_path, None)
+    if cache_index is not None:
+        cache_index.close()
+    _memory_caches.pop(cache_paths.cache_dir, None)
 
 
 def delete_cache():
     _logger.warning(f"Deleting cache: {cache_paths.cache_dir}")
+    cache_writer.flush()
+    get_memory_cache().clear()
+    get_cache_index().close()
     shutil.rmtree(cache_paths.cache_dir)
 
 
-def cached(func, cache_key=None, reset=False):
+def evict_cache(max_bytes=None, ttl=None):
+    """
+    Evicts entries from the cache, to keep it within its limits.
+
+    :param max_bytes:   The maximum total size of the cache in bytes. The least recently used entries are evicted first.
+                        Defaults to the MYAUTOML_CACHE_MAX_BYTES setting.
+    :param ttl:         The maximum age of a cache entry in seconds. Defaults to the MYAUTOML_CACHE_TTL setting.
+    :return:            The number of evicted entries
+    """
+    if max_bytes is None:
+        max_bytes = cache_settings.max_bytes
+    if ttl is None:
+        ttl = cache_settings.ttl
+    evicted_paths = get_cache_index().evict(max_bytes=max_bytes, ttl=ttl)
+    for path in evicted_paths:
+        delete_object(path)
+    return len(evicted_paths)
+
+
+def cache_stats():
+    """
+    Returns the statistics of the cache: the number of hits and misses, the number of bytes read from and written to
+    the cache, the number of evicted entries, and the current number of entries and total size of the cache.
+    The statistics of the in-process memory tier (of the current process only) are included with a 'memory_' prefix.
+    """
+    stats = get_cache_index().stats()
+    stats.update(get_memory_cache().stats())
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / lookups if lookups > 0 else None
+    return stats
+
+
+def reset_cache_stats():
+    get_cache_index().reset_stats()
+
+
+def flush_cache_writes(timeout=None):
+    """Waits until all background cache writes (see cached) have finished."""
+    cache_writer.flush(timeout=timeout)
+
+
+def _write_cache_entry(cache_index, data_dir, ck, result):
+    # Every result is written to a new file, so that concurrent writers never write to the same file
+    cache_path = save_object(result, data_dir / uuid.uuid4().hex)
+    size = object_size(cache_path)
+    replaced_path = cache_index.insert(ck, cache_path, size=size)
+    if replaced_path is not None:
+        delete_object(replaced_path)
+    cache_index.increment_stats(bytes_written=size)
+    evict_cache()
+
+
+def _write_and_release(write_entry, lock, result):
+    try:
+        write_entry(result)
+    finally:
+        lock.release()
+
+
+def make_cache_key(func, args, kwargs, code_fingerprint=None):
+    """
+    Creates a cache key from the function name and a content based fingerprint of its args and kwargs.
+    If a code_fingerprint (see function_fingerprint) is given, it is included in the key as well.
+    """
+    return f"{func.__name__}-{fingerprint((func.__module__, func.__qualname__, code_fingerprint, args, kwargs))}"
+
+
+def cached(func, cache_key=None, reset=False, memory=True, copy_result=False, mmap_mode='c', background=False,
+           hash_code=False):
     """
     This wrapper loads the result of the function (given its args and kwargs) from a cache file if it exists.
     If not, it executes the function as usual and stores the result in a cache file for future reference.
     If the reset flag is set to True, any pre-existing cache file will be ignored and overwritten.
+    After every write, the cache is kept within the limits of the cache settings (see evict_cache).
+
+    Results are also kept in an in-process memory tier (see MemoryCache), so that repeated calls in the same process
+    return the result without loading it from disk again. Its budget and eviction policy are set by the
+    MYAUTOML_CACHE_MEMORY_BYTES and MYAUTOML_CACHE_MEMORY_POLICY settings.
+
+    NumPy arrays and numeric pandas DataFrames are stored in memory mappable formats (see myautoml.utils.storage), so
+    that loading large cached results is fast and several processes can share the same pages. Other DataFrames are
+    copied into memory when loading.
+
+    In background mode, results are written to the cache on a background thread (see CacheWriter), so that the caller
+    gets the result as soon as it has been computed. The result should then not be modified before it has been
+    written; flush_cache_writes waits for all pending writes, and they are flushed at interpreter exit.
+
+    If several processes miss the same key at the same time, only one of them computes the result, while the others
+    wait for it and then load it from the cache (single-flight). The waiting time is bounded by the
+    MYAUTOML_CACHE_LOCK_TIMEOUT setting, and locks of processes that died are broken (see FileLock).
+
+    If hash_code is True, the cache key also includes a fingerprint of the code of the function, its closure, the
+    functions of the same module it calls and the myautoml version (see function_fingerprint). Editing the function then
+    invalidates its cached results only, without the need for reset=True or delete_cache(). The outdated entries are
+    removed by the regular eviction (see evict_cache).
 
     Example 1:
         If you normally would call
@@ -86,35 +303,112 @@ def cached(func, cache_key=None, reset=False):
 
     :param func:        The original function to be executed
     :param cache_key    The key to be used in the index. If None, a key will be created based on the function name, and
-                        its args and kwargs
+                        a fingerprint of the content of its args and kwargs (see myautoml.utils.fingerprint)
     :param reset:       Boolean indicator to specify whether the existing cache should be overwritten
+    :param memory:      Boolean indicator to specify whether the in-process memory tier should be used
+    :param copy_result: Boolean indicator to specify whether results from the memory tier should be (deep) copied,
+                        so that modifying a result does not affect the results of later calls
+    :param mmap_mode:   The mode to memory map cached arrays and the columns of cached numeric DataFrames with (see
+                        numpy.load), or None to load them into memory. With the default 'c' (copy-on-write), they
+                        share their pages, but are writable like computed results, without modifying the cache file.
+                        With 'r', they are read-only.
+    :param background:  Boolean indicator to specify whether results should be written to the cache in the background
+    :param hash_code:   Boolean indicator to specify whether the code of the function should be part of the cache key
     :return:            A modified function, which loads the result from the cache file if it exists,
                         and which executes the original function if it doesn't.
     """
-    cache_index = get_cache_index()
+    code_fingerprint = function_fingerprint(func) if hash_code else None
 
     def cached_func(*args, **kwargs):
+        cache_index = get_cache_index()
         if cache_key is None:
-            ck = (('func', func.__name__),
-                  ('args', args),
-                  ('kwargs', *[(k, v) for k, v in kwargs.items()]))
+            ck = make_cache_key(func, args, kwargs, code_fingerprint=code_fingerprint)
         else:
-            ck = cache_key
+            ck = fingerprint((cache_key, code_fingerprint))
         _logger.debug(f"Cache key: {ck}")
-        if ck not in cache_index.keys():
-            cache_index[ck] = str(cache_paths.data_dir / uuid.uuid4().hex)
-        cache_path = Path(cache_index[ck])
+
+        ttl = cache_settings.ttl
+        min_created = None if ttl is None else time.time() - ttl
+        memory_cache = get_memory_cache() if memory else None
+
+        def is_valid(entry):
+            return entry is not None and (ttl is None or entry.created >= min_created) and entry.path.exists()
+
+        def load_entry():
+            entry = cache_index.get(ck)
+            if not is_valid(entry):
+                return _MISSING
+            try:
+                result = load_object(entry.path, mmap_mode=mmap_mode)
+            except FileNotFoundError:
+                # The file has been evicted by another process in the meantime
+                _logger.debug(f"Cache file evicted while loading, treating it as a miss: {entry.path}")
+                return _MISSING
+            cache_index.increment_stats(hits=1, bytes_read=entry.size)
+            if memory:
+                memory_cache.put(ck, result, created=entry.created)
+                if copy_result:
+                    result = copy.deepcopy(result)
+            return result
 
         if reset:
             _logger.info("Deleting any pre-existing cache")
-            cache_path.unlink()
+            if memory:
+                memory_cache.pop(ck)
+            cache_path = cache_index.delete(ck)
+            if cache_path is not None:
+                delete_object(cache_path)
+        else:
+            if memory:
+                result = memory_cache.get(ck, default=_MISSING, copy_result=copy_result, min_created=min_created)
+                if result is not _MISSING:
+                    return result
+
+            result = cache_writer.get_pending(ck, default=_MISSING)
+            if result is not _MISSING:
+                return copy.deepcopy(result) if copy_result else result
+
+            result = load_entry()
+            if result is not _MISSING:
+                return result
+
+        # Single-flight: only one process computes the result, other processes wait for it to appear in the cache
+        # The lock is named after the digest of the key only, as function names may be e.g. '<lambda>'
+        lock = FileLock(cache_paths.lock_dir / f"{ck.rpartition('-')[2]}.lock",
+                        stale_after=cache_settings.lock_stale_after)
+        try:
+            # Waiting is only aborted for a valid entry, not for an expired entry or an entry without file
+            acquired = lock.acquire(timeout=cache_settings.lock_timeout,
+                                    abort=lambda: is_valid(cache_index.get(ck, touch=False)))
+        except LockTimeout:
+            _logger.warning(f"Timeout waiting for another process to compute the result, computing it anyway: {ck}")
+            acquired = False
+
+        try:
+            if not reset or not acquired:
+                # The result may have been computed by another process while waiting
+                result = load_entry()
+                if result is not _MISSING:
+                    return result
+
+            cache_index.increment_stats(misses=1)
+            result = func(*args, **kwargs)
 
-        if Path(cache_path).exists():
-            return load_pickle(cache_path)
-        result = func(*args, **kwargs)
+            write_entry = partial(_write_cache_entry, cache_index, cache_paths.data_dir, ck)
+            if background:
+                # The lock is released by the writer thread, once the result has been written
+                cache_writer.submit(ck, partial(_write_and_release, write_entry, lock), result)
+                lock = None
+            else:
+                write_entry(result)
+        finally:
+            if lock is not None:
+                lock.release()
 
-        save_pickle(result, cache_path)
-        _save_cache_index(cache_index)
+        if memory:
+            memory_cache.put(ck, result, created=time.time())
+            if copy_result:
+                result = copy.deepcopy(result)
 
         return result
 
@@ -122,3 +416,4 @@ def cached(func, cache_key=None, reset=False):
 
 
 cache_paths = CachePaths()
+cache_settings = CacheSettings()
@@ -0,0 +1,191 @@
+from collections import namedtuple
+import logging
+import os
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+CacheEntry = namedtuple('CacheEntry', ['key', 'path', 'size', 'created', 'last_access'])
+
+STATS = ('hits', 'misses', 'bytes_read', 'bytes_written', 'evictions')
+
+
+class CacheIndex:
+    """
+    Index of the cache, mapping cache keys to the paths of the cache files.
+
+    The index is stored in a SQLite database in WAL mode, so that several processes (e.g. parallel hyperopt workers
+    or training jobs sharing the same MYAUTOML_CACHE_DIR) can look up and insert entries concurrently. Each insert
+    is a separate transaction, so entries are never lost and the index is never rewritten as a whole.
+
+    Besides the path, the index keeps track of the size and the last access time of every entry, so that the cache
+    can be bounded in size (see evict), and of the hit / miss statistics of the cache (see stats).
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = Path(path)
+        self.timeout = timeout
+        self._lock = threading.RLock()
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self):
+        # SQLite connections must not be shared with forked child processes, so every process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            _logger.debug(f"Opening cache index: {self.path}")
+            connection = sqlite3.connect(str(self.path), timeout=self.timeout, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS entries ("
+                               "key TEXT PRIMARY KEY, "
+                               "path TEXT NOT NULL, "
+                               "size INTEGER NOT NULL, "
+                               "created REAL NOT NULL, "
+                               "last_access REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            connection.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key, touch=True):
+        """
+        Returns the CacheEntry for the key, or None if the key is not in the index.
+
+        If touch is True, the last access time of the entry is updated.
+        """
+        with self._lock:
+            connection = self.connection
+            row = connection.execute("SELECT key, path, size, created, last_access FROM entries WHERE key = ?",
+                                     (key,)).fetchone()
+            if row is not None and touch:
+                connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        return None if row is None else CacheEntry(row[0], Path(row[1]), *row[2:])
+
+    def insert(self, key, path, size=0):
+        """
+        Inserts or replaces the entry for the key.
+
+        :return:    The path of the cache file of the replaced entry, if any, so that it can be cleaned up.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute("SELECT path FROM entries WHERE key = ?", (key,)).fetchone()
+                connection.execute("INSERT OR REPLACE INTO entries (key, path, size, created, last_access) "
+                                   "VALUES (?, ?, ?, ?, ?)",
+                                   (key, str(path), size, now, now))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        if row is not None and row[0] != str(path):
+            return Path(row[0])
+        return None
+
+    def delete(self, key):
+        """Deletes the entry for the key and returns the path of its cache file, or None if there was no entry."""
+        with self._lock:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute("SELECT path FROM entries WHERE key = ?", (key,)).fetchone()
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return None if row is None else Path(row[0])
+
+    def evict(self, max_bytes=None, ttl=None):
+        """
+        Removes entries from the index, to keep the cache within its limits.
+
+        :param max_bytes:   If not None, the least recently used entries are removed until the total size of the
+                            remaining entries is at most max_bytes
+        :param ttl:         If not None, entries created more than ttl seconds ago are removed
+        :return:            The paths of the cache files of the removed entries, so that they can be cleaned up
+        """
+        if max_bytes is None and ttl is None:
+            return []
+
+        with self._lock:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                evicted = []
+                if ttl is not None:
+                    evicted += connection.execute("SELECT key, path FROM entries WHERE created < ?",
+                                                  (time.time() - ttl,)).fetchall()
+                if max_bytes is not None:
+                    total_size = 0
+                    expired = {key for key, _ in evicted}
+                    rows = connection.execute("SELECT key, path, size FROM entries ORDER BY last_access DESC")
+                    for key, path, size in rows:
+                        if key in expired:
+                            continue
+                        total_size += size
+                        if total_size > max_bytes:
+                            evicted.append((key, path))
+                connection.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+                connection.execute("INSERT INTO stats (name, value) VALUES ('evictions', ?) "
+                                   "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                                   (len(evicted),))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+        if len(evicted) > 0:
+            _logger.debug(f"Evicted {len(evicted)} entries from the cache index")
+        return [Path(path) for _, path in evicted]
+
+    def total_size(self):
+        with self._lock:
+            return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def increment_stats(self, **counts):
+        """Increments the cache statistics, e.g. increment_stats(hits=1, bytes_read=1024)."""
+        with self._lock:
+            self.connection.executemany("INSERT INTO stats (name, value) VALUES (?, ?) "
+                                        "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                                        list(counts.items()))
+
+    def stats(self):
+        """Returns the cache statistics, together with the number of entries and the total size of the cache."""
+        with self._lock:
+            stats = dict.fromkeys(STATS, 0)
+            stats.update(self.connection.execute("SELECT name, value FROM stats").fetchall())
+            stats['entries'] = len(self)
+            stats['size'] = self.total_size()
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            self.connection.execute("DELETE FROM stats")
+
+    def keys(self):
+        with self._lock:
+            return [row[0] for row in self.connection.execute("SELECT key FROM entries")]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+            self._pid = None
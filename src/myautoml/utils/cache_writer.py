@@ -0,0 +1,79 @@
+import atexit
+from concurrent.futures import ThreadPoolExecutor, wait
+import logging
+import os
+import threading
+
+_logger = logging.getLogger(__name__)
+
+
+class CacheWriter:
+    """
+    Writes cache entries on background threads (write-behind), so that the caller does not have to wait for them.
+
+    Results that are still being written can be looked up with get_pending. All pending writes are flushed at
+    interpreter exit.
+
+    :param max_workers: The number of writer threads
+    """
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._pending = {}
+
+    @property
+    def executor(self):
+        # Writer threads do not survive a fork, so a forked child process creates its own executor
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='myautoml-cache')
+            self._pid = os.getpid()
+            self._pending = {}
+        return self._executor
+
+    def submit(self, key, write_func, result):
+        """Schedules write_func(result) to be executed on a writer thread, and returns its future."""
+        with self._lock:
+            future = self.executor.submit(self._write, key, write_func, result)
+            self._pending[key] = (future, result)
+        return future
+
+    def _write(self, key, write_func, result):
+        try:
+            write_func(result)
+        except Exception:
+            _logger.exception(f"Error writing cache entry: {key}")
+            raise
+        finally:
+            with self._lock:
+                if key in self._pending and self._pending[key][1] is result:
+                    del self._pending[key]
+
+    def get_pending(self, key, default=None):
+        """Returns the result that is being written for the key, or the default if there is no pending write."""
+        with self._lock:
+            pending = self._pending.get(key)
+        return default if pending is None else pending[1]
+
+    def flush(self, timeout=None):
+        """Waits until all pending writes have finished."""
+        with self._lock:
+            futures = [future for future, _ in self._pending.values()]
+        if len(futures) > 0:
+            _logger.debug(f"Waiting for {len(futures)} pending cache writes")
+            wait(futures, timeout=timeout)
+
+    def close(self):
+        """Flushes all pending writes and stops the writer threads."""
+        with self._lock:
+            executor = self._executor if self._pid == os.getpid() else None
+            self._executor = None
+            self._pending = {}
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+cache_writer = CacheWriter()
+atexit.register(cache_writer.close)
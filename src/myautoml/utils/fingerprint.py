@@ -0,0 +1,226 @@
+import hashlib
+import logging
+import pickle
+import types
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import BaseEstimator
+
+from myautoml import __version__ as myautoml_version
+
+_logger = logging.getLogger(__name__)
+
+# Arrays are fed to the hash function in blocks of (at most) this many bytes, so that hashing a non-contiguous
+# multi-GB array never requires a contiguous copy of the whole array
+CHUNK_BYTES = 64 * 1024 * 1024
+
+
+class _HashWriter:
+    """File-like object that feeds everything written to it into a hash object."""
+
+    def __init__(self, hasher):
+        self.hasher = hasher
+
+    def write(self, b):
+        self.hasher.update(b)
+
+
+class _HashPickler(pickle.Pickler):
+    """Pickler that streams numeric NumPy arrays directly into the hash instead of pickling them."""
+
+    def __init__(self, hasher):
+        super().__init__(_HashWriter(hasher), protocol=4)
+        self.hasher = hasher
+
+    def persistent_id(self, obj):
+        if isinstance(obj, (np.ndarray, pd.DataFrame, pd.Series, pd.Index)) or sparse.issparse(obj):
+            _update(self.hasher, obj)
+            return type(obj).__name__
+        return None
+
+
+def _update_array(hasher, arr):
+    arr = np.asarray(arr)
+    hasher.update(f"ndarray:{arr.dtype.str}:{arr.shape}".encode())
+    if arr.dtype.hasobject:
+        _update_pickle(hasher, arr.tolist())
+        return
+    if arr.dtype.names is not None:
+        # Structured arrays may contain uninitialised padding bytes, so they are hashed field by field
+        for name in arr.dtype.names:
+            _update_array(hasher, arr[name])
+        return
+    if arr.ndim == 0 or arr.size == 0:
+        hasher.update(arr.tobytes())
+        return
+    if arr.flags.c_contiguous:
+        flat = arr.reshape(-1).view(np.uint8)
+        for start in range(0, flat.shape[0], CHUNK_BYTES):
+            hasher.update(flat[start:start + CHUNK_BYTES])
+        return
+    # Non-contiguous arrays are hashed in row blocks, to bound the size of the intermediate copies
+    rows_per_chunk = max(1, CHUNK_BYTES // max(1, arr[0].nbytes))
+    for start in range(0, arr.shape[0], rows_per_chunk):
+        hasher.update(np.ascontiguousarray(arr[start:start + rows_per_chunk]).reshape(-1).view(np.uint8))
+
+
+def _update_series(hasher, series):
+    hasher.update(f"series:{series.dtype}".encode())
+    _update(hasher, series.name)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        _update_array(hasher, series.cat.codes.to_numpy())
+        _update(hasher, series.cat.categories)
+    else:
+        _update_array(hasher, series.to_numpy())
+
+
+def _update_pickle(hasher, obj):
+    _HashPickler(hasher).dump(obj)
+
+
+def _update(hasher, obj):
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes)):
+        hasher.update(f"{type(obj).__name__}:{obj!r}".encode())
+    elif isinstance(obj, (tuple, list)):
+        hasher.update(f"{type(obj).__name__}:{len(obj)}".encode())
+        for item in obj:
+            _update(hasher, item)
+    elif isinstance(obj, (set, frozenset)):
+        hasher.update(f"{type(obj).__name__}:{len(obj)}".encode())
+        for item in sorted(obj, key=fingerprint):
+            _update(hasher, item)
+    elif isinstance(obj, dict):
+        hasher.update(f"dict:{len(obj)}".encode())
+        for key, value in sorted(obj.items(), key=lambda kv: fingerprint(kv[0])):
+            _update(hasher, key)
+            _update(hasher, value)
+    elif isinstance(obj, np.ndarray):
+        _update_array(hasher, obj)
+    elif isinstance(obj, pd.DataFrame):
+        hasher.update(f"dataframe:{obj.shape}".encode())
+        _update(hasher, obj.index)
+        _update(hasher, obj.columns)
+        for i in range(obj.shape[1]):
+            _update_series(hasher, obj.iloc[:, i])
+    elif isinstance(obj, pd.Series):
+        _update(hasher, obj.index)
+        _update_series(hasher, obj)
+    elif isinstance(obj, pd.RangeIndex):
+        hasher.update(f"rangeindex:{obj.start}:{obj.stop}:{obj.step}".encode())
+        _update(hasher, obj.name)
+    elif isinstance(obj, pd.Index):
+        hasher.update(f"index:{type(obj).__name__}".encode())
+        _update(hasher, list(obj.names))
+        _update_series(hasher, obj.to_series(index=pd.RangeIndex(len(obj))))
+    elif sparse.issparse(obj):
+        csr = obj.tocsr()
+        if not csr.has_canonical_format:
+            csr = csr.copy()
+            csr.sum_duplicates()
+        hasher.update(f"sparse:{csr.dtype.str}:{csr.shape}".encode())
+        _update_array(hasher, csr.indptr)
+        _update_array(hasher, csr.indices)
+        _update_array(hasher, csr.data)
+    elif isinstance(obj, BaseEstimator):
+        # Covers both the hyper-parameters and the fitted attributes of an estimator
+        hasher.update(f"estimator:{type(obj).__module__}.{type(obj).__qualname__}".encode())
+        _update(hasher, dict(vars(obj)))
+    else:
+        hasher.update(f"pickle:{type(obj).__module__}.{type(obj).__qualname__}".encode())
+        _update_pickle(hasher, obj)
+
+
+def fingerprint(obj, hash_name='blake2b'):
+    """
+    Computes a content based fingerprint of an object.
+
+    NumPy arrays, pandas objects, sparse matrices and Scikit-Learn estimators are hashed by their content, streaming
+    over their underlying buffers. Other objects are hashed by their pickled representation, in which any nested
+    arrays are again hashed by content. Equal content therefore gives equal fingerprints, also across processes.
+
+    :param obj:         The object to fingerprint
+    :param hash_name:   The name of the hashlib algorithm to use
+    :return:            The hexadecimal digest of the fingerprint
+    """
+    hasher = hashlib.new(hash_name)
+    _update(hasher, obj)
+    return hasher.hexdigest()
+
+
+def _update_code(hasher, code):
+    # The bytecode does not contain line numbers, so e.g. adding comments or blank lines does not change the hash
+    hasher.update(f"code:{code.co_name}:{code.co_argcount}:{code.co_kwonlyargcount}:{code.co_flags}".encode())
+    hasher.update(code.co_code)
+    _update(hasher, code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_code(hasher, const)
+        else:
+            _update(hasher, const)
+
+
+def _update_function(hasher, func, seen):
+    if func in seen:
+        hasher.update(f"seen:{func.__module__}.{func.__qualname__}".encode())
+        return
+    seen.add(func)
+
+    hasher.update(f"function:{func.__module__}.{func.__qualname__}".encode())
+    _update_code(hasher, func.__code__)
+    _update(hasher, func.__defaults__)
+    _update(hasher, func.__kwdefaults__)
+
+    # The values captured in the closure, and the functions of the same module that are called by the function
+    closure = [] if func.__closure__ is None else [cell.cell_contents for cell in func.__closure__]
+    dependencies = [func.__globals__[name] for name in func.__code__.co_names
+                    if isinstance(func.__globals__.get(name), types.FunctionType)
+                    and func.__globals__[name].__module__ == func.__module__]
+    for value in [*closure, *dependencies]:
+        if isinstance(value, types.FunctionType):
+            _update_function(hasher, value, seen)
+        else:
+            _update_captured(hasher, value)
+
+
+def _update_captured(hasher, value):
+    # A closure may capture modules (e.g. of a local import) and other objects that can not be pickled, like locks or
+    # connections. Modules are hashed by name, and other unpicklable objects by their type only.
+    if isinstance(value, types.ModuleType):
+        hasher.update(f"module:{value.__name__}".encode())
+        return
+    try:
+        value_fingerprint = fingerprint(value)
+    except (TypeError, AttributeError, pickle.PicklingError) as e:
+        _logger.debug(f"Captured value of type {type(value).__qualname__} can not be hashed, hashing its type only: "
+                      f"{str(e)}")
+        value_fingerprint = f"unpicklable:{type(value).__module__}.{type(value).__qualname__}"
+    hasher.update(value_fingerprint.encode())
+
+
+def function_fingerprint(func, hash_name='blake2b'):
+    """
+    Computes a fingerprint of the code of a function.
+
+    The fingerprint covers the bytecode and constants of the function, its default arguments, the values in its
+    closure, and (recursively) the functions of the same module it calls, as well as the myautoml version. It changes
+    when the behaviour of the function changes, but not when e.g. only comments are edited.
+
+    :param func:        The function to fingerprint
+    :param hash_name:   The name of the hashlib algorithm to use
+    :return:            The hexadecimal digest of the fingerprint
+    """
+    hasher = hashlib.new(hash_name)
+    hasher.update(f"myautoml:{myautoml_version}".encode())
+    # Unwrap decorated functions (e.g. functools.wraps) and methods
+    func = getattr(func, '__func__', func)
+    while hasattr(func, '__wrapped__'):
+        func = func.__wrapped__
+    if isinstance(func, types.FunctionType):
+        _update_function(hasher, func, set())
+    else:
+        # Builtins, and other callables without Python bytecode
+        hasher.update(f"callable:{getattr(func, '__module__', None)}.{getattr(func, '__qualname__', repr(func))}"
+                      .encode())
+    return hasher.hexdigest()
@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+from pathlib import Path
+import socket
+import threading
+import time
+import uuid
+
+_logger = logging.getLogger(__name__)
+
+
+class LockTimeout(TimeoutError):
+    pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists, but belongs to another user
+        return True
+    return True
+
+
+class FileLock:
+    """
+    Inter-process lock, based on the atomic creation of a lock file.
+
+    The lock file contains the host, pid and a unique token of its owner. While the lock is held, a heartbeat thread
+    regularly updates the modification time of the lock file. A lock is considered stale, and is broken by the next
+    process trying to acquire it, if its owner process on the same host no longer exists, or if the lock file has not
+    been updated for stale_after seconds (e.g. because its owner on another host died).
+
+    :param path:            The path of the lock file
+    :param stale_after:     The number of seconds after which a lock file without heartbeat is considered stale
+    :param poll_interval:   The number of seconds to wait between attempts to acquire the lock
+    """
+
+    def __init__(self, path, stale_after=60, poll_interval=0.1):
+        self.path = Path(path)
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self.token = None
+        self._heartbeat = None
+        self._stop_heartbeat = threading.Event()
+
+    @property
+    def locked(self):
+        return self.token is not None
+
+    def _read_owner(self, path=None):
+        try:
+            with open(self.path if path is None else path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_stale(self):
+        owner = self._read_owner()
+        if owner is not None and owner.get('host') == socket.gethostname() and not _pid_alive(owner.get('pid')):
+            return True
+        try:
+            return time.time() - self.path.stat().st_mtime > self.stale_after
+        except FileNotFoundError:
+            return False
+
+    def _break_stale_lock(self):
+        owner = self._read_owner()
+        if not self.is_stale():
+            return
+        # Rename the lock file first, so that only one process breaks it, and check that it is still the same lock
+        # (and not a new lock created by another process in the meantime)
+        stale_path = self.path.with_name(f"{self.path.name}.{uuid.uuid4().hex}.stale")
+        try:
+            os.rename(self.path, stale_path)
+        except FileNotFoundError:
+            return
+        if self._read_owner(stale_path) == owner:
+            _logger.warning(f"Breaking stale lock: {self.path} (owner: {owner})")
+            stale_path.unlink(missing_ok=True)
+        else:
+            try:
+                os.link(stale_path, self.path)
+            except FileExistsError:
+                pass
+            stale_path.unlink(missing_ok=True)
+
+    def _try_acquire(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        token = uuid.uuid4().hex
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'host': socket.gethostname(), 'pid': os.getpid(), 'token': token, 'created': time.time()}, f)
+        self.token = token
+        self._start_heartbeat()
+        return True
+
+    def acquire(self, timeout=None, abort=None):
+        """
+        Acquires the lock.
+
+        :param timeout: The maximum number of seconds to wait for the lock, or None to wait indefinitely
+        :param abort:   Optional callable, which is called while waiting. If it returns True, waiting is aborted.
+        :return:        True if the lock has been acquired, False if waiting has been aborted
+        :raises LockTimeout: If the lock could not be acquired within the timeout
+        """
+        start = time.time()
+        while True:
+            if self._try_acquire():
+                return True
+            self._break_stale_lock()
+            if self._try_acquire():
+                return True
+            if abort is not None and abort():
+                return False
+            if timeout is not None and time.time() - start > timeout:
+                raise LockTimeout(f"Timeout acquiring lock: {self.path}")
+            time.sleep(self.poll_interval)
+
+    def release(self):
+        if not self.locked:
+            return
+        self._stop_heartbeat.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        owner = self._read_owner()
+        if owner is not None and owner.get('token') == self.token:
+            self.path.unlink(missing_ok=True)
+        else:
+            _logger.warning(f"Lock was broken by another process: {self.path}")
+        self.token = None
+        self._heartbeat = None
+
+    def _start_heartbeat(self):
+        self._stop_heartbeat.clear()
+
+        def heartbeat():
+            while not self._stop_heartbeat.wait(self.stale_after / 3):
+                try:
+                    os.utime(self.path)
+                except FileNotFoundError:
+                    return
+
+        self._heartbeat = threading.Thread(target=heartbeat, name=f'myautoml-lock-{self.path.name}', daemon=True)
+        self._heartbeat.start()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
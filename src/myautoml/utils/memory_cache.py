@@ -0,0 +1,122 @@
+from collections import OrderedDict
+import copy
+import logging
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+_logger = logging.getLogger(__name__)
+
+POLICIES = ('lru', 'fifo')
+
+
+def estimate_size(obj):
+    """Estimates the memory footprint of an object in bytes."""
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(np.sum(obj.memory_usage(deep=True)))
+    if sparse.issparse(obj):
+        return sum(getattr(obj, attr).nbytes for attr in ('data', 'indices', 'indptr', 'row', 'col')
+                   if hasattr(obj, attr))
+    if isinstance(obj, (tuple, list)):
+        return sys.getsizeof(obj) + sum(estimate_size(item) for item in obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_size(k) + estimate_size(v) for k, v in obj.items())
+    return sys.getsizeof(obj)
+
+
+class MemoryCache:
+    """
+    In-process cache with a memory budget, which is used as a first tier in front of the disk cache.
+
+    :param max_bytes:   The memory budget in bytes. When it is exceeded, entries are evicted according to the policy.
+    :param policy:      The eviction policy: 'lru' evicts the least recently used entry first, 'fifo' the oldest one
+    """
+
+    def __init__(self, max_bytes, policy='lru'):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.max_bytes = None
+        self.policy = None
+        self.configure(max_bytes, policy)
+
+    def configure(self, max_bytes, policy='lru'):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown eviction policy: {policy}. Choose one of {POLICIES}")
+        with self._lock:
+            self.max_bytes = max_bytes
+            self.policy = policy
+            self._evict()
+
+    def get(self, key, default=None, copy_result=False, min_created=None):
+        """
+        Returns the value stored for the key, or the default if the key is not in the cache.
+
+        :param copy_result: If True, a (deep) copy of the stored value is returned, so that the caller can safely
+                            modify the result without affecting the cache
+        :param min_created: If not None, entries created before this time are considered expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and min_created is not None and entry[2] < min_created:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            if self.policy == 'lru':
+                self._entries.move_to_end(key)
+            value = entry[0]
+        return copy.deepcopy(value) if copy_result else value
+
+    def put(self, key, value, created, size=None):
+        if size is None:
+            size = estimate_size(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                _logger.debug(f"Not keeping cache entry in memory, its size exceeds the memory budget: {size}")
+                return
+            self._entries[key] = (value, size, created)
+            self._size += size
+            self._evict()
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'memory_hits': self.hits,
+                    'memory_misses': self.misses,
+                    'memory_entries': len(self._entries),
+                    'memory_size': self._size}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._entries) > 0:
+            self._remove(next(iter(self._entries)))
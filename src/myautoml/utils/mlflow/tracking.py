@@ -1,7 +1,6 @@
 import importlib
 import logging
 from pathlib import Path
-import pickle
 import tempfile
 from yaml import safe_load
 
@@ -11,6 +10,8 @@ import mlflow
 import mlflow.sklearn
 from mlflow.entities import RunInfo
 
+from myautoml.utils.pickle import load_pickle
+
 _logger = logging.getLogger(__name__)
 
 
@@ -41,7 +42,7 @@ def track_sk_model_from_file(local_path: str,
                              metrics: dict = None,
                              artifacts: dict = None) -> RunInfo:
     _logger.debug(f"Loading Scikit-Learn model from file {local_path}")
-    sk_model = pickle.load(open(local_path, 'rb'))
+    sk_model = load_pickle(local_path)
     return track_sk_model(sk_model,
                           experiment_name=experiment_name,
                           run_name=run_name,
@@ -1,11 +1,58 @@
 import logging
 
+from sklearn.base import clone
 from sklearn.pipeline import Pipeline
 
+from .cache import cache_paths, cached
+
 _logger = logging.getLogger(__name__)
 
 
-def make_pipeline(preprocessor, estimator):
+def make_pipeline(preprocessor, estimator, memory=None):
+    """
+    Defines the model as a pipeline of a preprocessor and an estimator.
+
+    :param preprocessor:    The preprocessor, e.g. a ColumnTransformer
+    :param estimator:       The estimator
+    :param memory:          Passed to the Pipeline to cache the fitted preprocessor (see sklearn.pipeline.Pipeline).
+                            If True, the fitted preprocessor is cached in the myautoml cache dir.
+    """
     _logger.debug("Defining the model as a pipeline")
+    if memory is True:
+        memory = str(cache_paths.cache_dir / 'pipeline')
+        _logger.debug(f"Caching the fitted preprocessor of the pipeline in: {memory}")
     return Pipeline(steps=[('preprocessor', preprocessor),
-                           ('estimator', estimator)])
+                           ('estimator', estimator)],
+                    memory=memory)
+
+
+def _fit_preprocessor(preprocessor, x, y, transform):
+    fitted_preprocessor = clone(preprocessor).fit(x, y)
+    return fitted_preprocessor, [fitted_preprocessor.transform(x_transform) for x_transform in transform]
+
+
+def fit_preprocessor(preprocessor, x, y=None, transform=None, cache=False):
+    """
+    Fits a (clone of the) preprocessor and transforms the given data sets with it.
+
+    If cache is True, the fitted preprocessor and the transformed data are cached (see myautoml.utils.cache.cached),
+    keyed on the parameters of the preprocessor and a fingerprint of the data. Re-running training, hyperopt or
+    calibration on unchanged data then reuses them, instead of fitting and transforming again.
+
+    Example:
+        preprocessor, (x_train_prep, x_test_prep) = fit_preprocessor(get_preprocessor(), x_train, y_train,
+                                                                     transform=[x_train, x_test], cache=True)
+
+    :param preprocessor:    The (unfitted) preprocessor
+    :param x:               The data to fit the preprocessor on
+    :param y:               The target to fit the preprocessor on
+    :param transform:       A list of data sets to transform with the fitted preprocessor
+    :param cache:           Boolean indicator to specify whether the results should be cached
+    :return:                The fitted preprocessor, and the list of transformed data sets
+    """
+    transform = [] if transform is None else list(transform)
+    if cache:
+        _logger.debug("Fitting the preprocessor (cached)")
+        return cached(_fit_preprocessor, hash_code=True)(preprocessor, x, y, transform)
+    _logger.debug("Fitting the preprocessor")
+    return _fit_preprocessor(preprocessor, x, y, transform)
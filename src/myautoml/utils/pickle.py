@@ -1,22 +1,139 @@
+import bz2
+import gzip
 import logging
+import lzma
+import os
 from pathlib import Path
-from pickle import dump, load
+import pickle
+import struct
+import tempfile
 
 _logger = logging.getLogger(__name__)
 
+# Pickle files with out-of-band buffers (see save_pickle) start with this header, followed by the number of buffers,
+# the length of the pickle data, the pickle data itself, and the length and raw bytes of each buffer. Files without
+# this header are regular pickle files.
+OUT_OF_BAND_MAGIC = b'MYAUTOML-PICKLE5\n'
+_LENGTH = struct.Struct('<Q')
 
-def save_pickle(obj, path):
+COMPRESSIONS = {
+    'gzip': (gzip.open, 'compresslevel', b'\x1f\x8b'),
+    'bz2': (bz2.open, 'compresslevel', b'BZh'),
+    'lzma': (lzma.open, 'preset', b'\xfd7zXZ\x00'),
+}
+
+
+def _open_compressed(path, mode, compression=None, compresslevel=None):
+    if compression is None:
+        return open(path, mode)
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression: {compression}. Choose one of {list(COMPRESSIONS)}")
+    open_func, level_kwarg, _ = COMPRESSIONS[compression]
+    kwargs = {} if compresslevel is None else {level_kwarg: compresslevel}
+    return open_func(path, mode, **kwargs)
+
+
+def _detect_compression(path):
+    with open(path, 'rb') as f:
+        header = f.read(6)
+    for compression, (_, _, magic) in COMPRESSIONS.items():
+        if header.startswith(magic):
+            return compression
+    return None
+
+
+def _dump_out_of_band(obj, file, protocol):
+    buffers = []
+    data = pickle.dumps(obj, protocol=protocol, buffer_callback=buffers.append)
+    file.write(OUT_OF_BAND_MAGIC)
+    file.write(_LENGTH.pack(len(buffers)))
+    file.write(_LENGTH.pack(len(data)))
+    file.write(data)
+    for buffer in buffers:
+        # The buffers are written directly from the memory of the (e.g. NumPy) objects, without intermediate copies
+        raw = buffer.raw()
+        file.write(_LENGTH.pack(raw.nbytes))
+        file.write(raw)
+
+
+def _dump(obj, file, protocol, out_of_band):
+    if out_of_band:
+        if protocol < 5:
+            raise ValueError(f"Out-of-band buffers require pickle protocol 5 or higher, not {protocol}")
+        _dump_out_of_band(obj, file, protocol)
+    else:
+        pickle.dump(obj, file, protocol=protocol)
+
+
+def _read_exactly(file, n):
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    pos = 0
+    while pos < n:
+        read = file.readinto(view[pos:])
+        if not read:
+            raise EOFError(f"Unexpected end of pickle file, expected {n} bytes but got {pos}")
+        pos += read
+    return buffer
+
+
+def _load_out_of_band(file):
+    n_buffers = _LENGTH.unpack(_read_exactly(file, _LENGTH.size))[0]
+    data_length = _LENGTH.unpack(_read_exactly(file, _LENGTH.size))[0]
+    data = _read_exactly(file, data_length)
+    # The objects are reconstructed on top of these (writable) buffers, without copying them again
+    buffers = [_read_exactly(file, _LENGTH.unpack(_read_exactly(file, _LENGTH.size))[0]) for _ in range(n_buffers)]
+    return pickle.loads(data, buffers=buffers)
+
+
+def save_pickle(obj, path, compression=None, compresslevel=None, protocol=pickle.HIGHEST_PROTOCOL, out_of_band=False):
+    """
+    Saves an object to a pickle file.
+
+    The file is first written to a temporary file, which is then renamed, so that an existing file is never left
+    corrupted if the process dies while writing. By default, the file is a regular pickle file (compressed if
+    compression is set), which can also be read with pickle.load.
+
+    With out_of_band, large buffers, such as the data of NumPy arrays, are written out-of-band (pickle protocol 5),
+    directly from memory. The file then has its own framing, which only load_pickle can read.
+
+    :param obj:             The object to save
+    :param path:            The path of the pickle file
+    :param compression:     None, or the compression to use: 'gzip', 'bz2' or 'lzma'
+    :param compresslevel:   The compression level (the preset for 'lzma'), or None for the default level
+    :param protocol:        The pickle protocol
+    :param out_of_band:     Boolean indicator to specify whether large buffers should be written out-of-band
+    """
     filepath = Path(path)
     filepath.parent.mkdir(parents=True, exist_ok=True)
-    _logger.debug(f"Saving to pickle file: {filepath}")
-    with open(filepath, 'wb') as cache_file:
-        dump(obj, cache_file)
+    _logger.debug(f"Saving to pickle file: {filepath} (compression={compression})")
+    temp_file = tempfile.NamedTemporaryFile(dir=filepath.parent, prefix=f".{filepath.name}.", suffix='.tmp',
+                                            delete=False)
+    temp_path = Path(temp_file.name)
+    try:
+        with temp_file:
+            if compression is None:
+                _dump(obj, temp_file, protocol, out_of_band)
+            else:
+                with _open_compressed(temp_file, 'wb', compression, compresslevel) as cache_file:
+                    _dump(obj, cache_file, protocol, out_of_band)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, filepath)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
     _logger.debug(f"Object saved to pickle file: {filepath}")
 
 
 def load_pickle(path):
+    """Loads an object from a pickle file, saved by save_pickle or a regular pickle file. Compression is detected."""
     _logger.debug(f"Loading from pickle file: {path}")
-    with open(path, 'rb') as cache_file:
-        obj = load(cache_file)
+    with _open_compressed(path, 'rb', _detect_compression(path)) as cache_file:
+        if cache_file.read(len(OUT_OF_BAND_MAGIC)) == OUT_OF_BAND_MAGIC:
+            obj = _load_out_of_band(cache_file)
+        else:
+            cache_file.seek(0)
+            obj = pickle.load(cache_file)
     _logger.debug(f"Object loaded from pickle file: {path}")
     return obj
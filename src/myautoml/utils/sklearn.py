@@ -13,6 +13,9 @@ def get_feature_out(estimator, feature_in):
                     for f in estimator.get_feature_names()]
         else:
             return estimator.get_feature_names(feature_in)
+    elif hasattr(estimator, 'get_feature_names_out') and not isinstance(estimator, (_VectorizerMixin, SelectorMixin)):
+        # Since Scikit-Learn 1.0, transformers like the OneHotEncoder implement get_feature_names_out instead
+        return list(estimator.get_feature_names_out(feature_in))
     elif isinstance(estimator, SelectorMixin):
         return np.array(feature_in)[estimator.get_support()]
     else:
@@ -0,0 +1,154 @@
+import logging
+from pathlib import Path
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from .pickle import load_pickle, save_pickle
+
+_logger = logging.getLogger(__name__)
+
+# The storage format of a file is determined by its suffix, files without a (known) suffix are pickle files
+NPY_SUFFIX = '.npy'
+# A directory with a .npy file per column, and the index and column names in a pickle file
+FRAME_SUFFIX = '.frame'
+FRAME_META = 'meta.pkl'
+FEATHER_SUFFIX = '.feather'
+PICKLE_SUFFIX = '.pkl'
+
+
+def _save_npy(arr, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _logger.debug(f"Saving to npy file: {path}")
+    np.save(path, arr, allow_pickle=False)
+
+
+def _load_npy(path, mmap_mode=None):
+    _logger.debug(f"Loading from npy file: {path} (mmap_mode={mmap_mode})")
+    return np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+
+
+def _is_numeric_frame(df):
+    # Only NumPy dtypes can be memory mapped, extension dtypes (e.g. categorical or nullable integers) can not
+    return isinstance(df, pd.DataFrame) and all(
+        isinstance(dtype, np.dtype) and dtype.kind in 'biufcmM' for dtype in df.dtypes)
+
+
+def _save_frame(df, path):
+    path.mkdir(parents=True, exist_ok=True)
+    _logger.debug(f"Saving to frame dir: {path}")
+    for i in range(df.shape[1]):
+        _save_npy(np.ascontiguousarray(df.iloc[:, i].to_numpy()), path / f"{i}{NPY_SUFFIX}")
+    save_pickle({'index': df.index, 'columns': df.columns}, path / FRAME_META)
+
+
+def _load_frame(path, mmap_mode=None):
+    _logger.debug(f"Loading from frame dir: {path} (mmap_mode={mmap_mode})")
+    meta = load_pickle(path / FRAME_META)
+    # Without a copy, every column is a block over a (plain ndarray) view of its memory mapped array
+    columns = {i: np.asarray(_load_npy(path / f"{i}{NPY_SUFFIX}", mmap_mode=mmap_mode))
+               for i in range(len(meta['columns']))}
+    df = pd.DataFrame(columns, index=meta['index'], copy=False)
+    df.columns = meta['columns']
+    return df
+
+
+def _save_feather(df, path):
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _logger.debug(f"Saving to feather file: {path}")
+    # Uncompressed, so that the file can be memory mapped when loading
+    feather.write_feather(table, str(path), compression='uncompressed')
+
+
+def _load_feather(path, mmap_mode=None):
+    import pyarrow.feather as feather
+
+    _logger.debug(f"Loading from feather file: {path} (memory_map={mmap_mode is not None})")
+    return feather.read_table(str(path), memory_map=mmap_mode is not None).to_pandas()
+
+
+def save_object(obj, path):
+    """
+    Saves an object in a storage format chosen by its type.
+
+    NumPy arrays are saved as .npy files, so that they can be memory mapped when loading. DataFrames of which all
+    columns have a NumPy numeric, boolean or datetime dtype are saved as a directory with a .npy file per column, so
+    that they are memory mapped column by column as well. Other DataFrames are saved as (uncompressed) Arrow Feather
+    files, which are copied into memory when loading. Feather files require pyarrow; if it is not installed, or the
+    DataFrame can not be converted to an Arrow table (e.g. because of non-string column names), the DataFrame is
+    pickled. All other objects are pickled.
+
+    :param obj:     The object to save
+    :param path:    The path to save the object to, without a suffix. The suffix of the format is appended to it.
+    :return:        The path of the saved file
+    """
+    path = Path(path)
+    if isinstance(obj, np.ndarray) and not obj.dtype.hasobject:
+        save_path = path.with_suffix(NPY_SUFFIX)
+        _save_npy(obj, save_path)
+        return save_path
+
+    if _is_numeric_frame(obj):
+        save_path = path.with_suffix(FRAME_SUFFIX)
+        _save_frame(obj, save_path)
+        return save_path
+
+    # Arrow only supports string column names, other column names would not survive the round trip
+    if isinstance(obj, pd.DataFrame) and all(isinstance(c, str) for c in obj.columns):
+        save_path = path.with_suffix(FEATHER_SUFFIX)
+        try:
+            _save_feather(obj, save_path)
+            return save_path
+        except ImportError:
+            _logger.debug("pyarrow is not installed, pickling the DataFrame instead")
+        except (TypeError, ValueError, NotImplementedError) as e:
+            # The conversion errors of pyarrow (ArrowInvalid, ArrowTypeError, ArrowNotImplementedError) subclass these
+            _logger.debug(f"DataFrame can not be saved as feather file, pickling it instead: {str(e)}")
+            save_path.unlink(missing_ok=True)
+
+    save_path = path.with_suffix(PICKLE_SUFFIX)
+    save_pickle(obj, save_path)
+    return save_path
+
+
+def load_object(path, mmap_mode='c'):
+    """
+    Loads an object saved by save_object.
+
+    :param path:        The path of the saved file
+    :param mmap_mode:   The mode to memory map .npy files and the columns of numeric DataFrames with (see numpy.load).
+                        Memory mapped arrays share their pages between processes instead of being copied. With the
+                        default 'c' (copy-on-write), loaded arrays are writable, without modifying the file. Feather
+                        files are read memory mapped if it is not None, but the DataFrame is still copied into memory.
+    :return:            The loaded object
+    """
+    path = Path(path)
+    if path.suffix == NPY_SUFFIX:
+        return _load_npy(path, mmap_mode=mmap_mode)
+    if path.suffix == FRAME_SUFFIX:
+        return _load_frame(path, mmap_mode=mmap_mode)
+    if path.suffix == FEATHER_SUFFIX:
+        return _load_feather(path, mmap_mode=mmap_mode)
+    return load_pickle(path)
+
+
+def object_size(path):
+    """Returns the size in bytes of an object saved by save_object, i.e. of its file or of all files in its dir."""
+    path = Path(path)
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.iterdir())
+    return path.stat().st_size
+
+
+def delete_object(path):
+    """Deletes an object saved by save_object, if it exists."""
+    path = Path(path)
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
@@ -1,6 +1,19 @@
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import numpy as np
 
 
+def new_figure():
+    """
+    Creates a figure with a single axes, drawn on its own Agg canvas instead of through the global pyplot state.
+
+    Such figures can be rendered concurrently in threads or worker processes, and do not need to be closed.
+    """
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    return fig, fig.subplots()
+
+
 def plot_grouped_bar(ax, groups_of_bars, x_labels, group_labels, colors):
     """Plot a grouped bar chart"""
     n_bars_in_group = len(groups_of_bars[0])
@@ -1,7 +1,12 @@
-from matplotlib import cm
+try:
+    from matplotlib import colormaps
+except ImportError:
+    # matplotlib < 3.5, the registry replaced cm.get_cmap, which was removed in matplotlib 3.9
+    from matplotlib import cm
+    colormaps = {name: cm.get_cmap(name) for name in ['Pastel1', 'Set1']}
 
-TRAIN_COLORS = cm.get_cmap('Pastel1')
-TEST_COLORS = cm.get_cmap('Set1')
+TRAIN_COLORS = colormaps['Pastel1']
+TEST_COLORS = colormaps['Set1']
 
 EVALUATION_COLORS = {
     'train': 'lightsteelblue',
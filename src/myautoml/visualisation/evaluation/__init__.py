@@ -1,18 +1,57 @@
 import logging
 
 import numpy as np
-import pandas as pd
-from sklearn.metrics import roc_auc_score, average_precision_score, roc_curve, precision_recall_curve
-from sklearn.calibration import calibration_curve
 
+from myautoml.evaluation.curves import BinaryClassifierCurves
 from myautoml.visualisation.colors import TEST_COLOR, BASELINE_COLOR
 
 _logger = logging.getLogger(__name__)
 
 
-def plot_roc(ax, y, y_pred_proba, legend_loc='best', label=None, *args, **kwargs):
-    auc = roc_auc_score(y, y_pred_proba)
-    fpr, tpr, threshold = roc_curve(y, y_pred_proba)
+def _get_curves(y, y_pred_proba, curves):
+    # The plot functions accept precomputed curves, so that the predictions are sorted only once for all plots
+    if curves is None:
+        curves = BinaryClassifierCurves(y, y_pred_proba)
+    return curves
+
+
+def decimate_curve(x, y, max_points=1000):
+    """
+    Reduces a curve to at most max_points points, while preserving its shape.
+
+    The points are sampled at fixed steps of the arc length of the curve (with both axes scaled to their range), so
+    that steep parts and corners of the curve keep as many points as flat parts. The first and last point are always
+    kept. Plotting the decimated curve takes the same time, regardless of the number of points of the original curve.
+
+    :param x:           The x coordinates of the curve
+    :param y:           The y coordinates of the curve
+    :param max_points:  The maximum number of points, or None to not decimate the curve
+    :return:            The x and y coordinates of the decimated curve
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if max_points is None or len(x) <= max_points:
+        return x, y
+
+    def scaled_diff(values):
+        values_range = np.nanmax(values) - np.nanmin(values)
+        return np.diff(values) / values_range if values_range > 0 else np.zeros(len(values) - 1)
+
+    arc_length = np.r_[0, np.cumsum(np.nan_to_num(np.hypot(scaled_diff(x), scaled_diff(y))))]
+    if arc_length[-1] > 0:
+        positions = np.linspace(0, arc_length[-1], max_points - 1)
+        idx = np.searchsorted(arc_length, positions, side='left')
+    else:
+        idx = np.linspace(0, len(x) - 1, max_points - 1).astype(int)
+    idx = np.unique(np.r_[0, np.minimum(idx, len(x) - 1), len(x) - 1])
+    return x[idx], y[idx]
+
+
+def plot_roc(ax, y, y_pred_proba, legend_loc='best', label=None, *args, curves=None, max_points=1000, **kwargs):
+    curves = _get_curves(y, y_pred_proba, curves)
+    auc = curves.roc_auc()
+    fpr, tpr, threshold = curves.roc_curve()
+    fpr, tpr = decimate_curve(fpr, tpr, max_points)
 
     ax.set_title('Receiver Operating Characteristic Curve')
     ax.set_xlabel('False Positive Rate')
@@ -33,9 +72,12 @@ def plot_roc(ax, y, y_pred_proba, legend_loc='best', label=None, *args, **kwargs
     return ax
 
 
-def plot_precision_recall(ax, y, y_pred_proba, legend_loc='best', label=None, *args, **kwargs):
-    auc = average_precision_score(y, y_pred_proba)
-    precision, recall, threshold = precision_recall_curve(y, y_pred_proba)
+def plot_precision_recall(ax, y, y_pred_proba, legend_loc='best', label=None, *args, curves=None, max_points=1000,
+                          **kwargs):
+    curves = _get_curves(y, y_pred_proba, curves)
+    auc = curves.average_precision()
+    precision, recall, threshold = curves.precision_recall_curve()
+    recall, precision = decimate_curve(recall, precision, max_points)
 
     ax.set_title('Precision-Recall Curve')
     ax.set_xlabel('Recall')
@@ -53,25 +95,16 @@ def plot_precision_recall(ax, y, y_pred_proba, legend_loc='best', label=None, *a
     return ax
 
 
-def plot_lift_deciles(ax, y, y_pred_proba):
-    # Sorting the class 1 probabilities and labels
-    df = pd.DataFrame({'labels': y, 'pred': y_pred_proba})
-    df = df.sort_values(by=['pred'], ascending=False)
-
-    # Calculating baseline for class 1 occurrence
-    baseline = df['labels'].sum() / len(df['labels'])
-
-    # Binning into deciles and calculating actual class 1 percentages
-    df_bins = df.groupby(pd.qcut(df['pred'], 10, duplicates='drop')).apply(
-        lambda a: a['labels'].sum() / len(a['labels']))
-    df_bins = (df_bins / baseline)
+def plot_lift_deciles(ax, y, y_pred_proba, curves=None, n_bins=10):
+    # Binning into deciles (or n_bins quantiles) and calculating the lift of the actual class 1 percentages over the
+    # baseline
+    lift = _get_curves(y, y_pred_proba, curves).lift_deciles(n_bins=n_bins)
 
     # Plotting the chart
     ax.set_title('Non-Cumulative Lift')
 
-    x = np.arange(len(df_bins)) + 1
-    y = np.flip(df_bins.values)
-    bars = ax.bar(x, y, color=TEST_COLOR)
+    x = np.arange(len(lift)) + 1
+    bars = ax.bar(x, lift, color=TEST_COLOR)
 
     ax.axhline(y=1, color=BASELINE_COLOR, linestyle='dotted')
 
@@ -88,24 +121,18 @@ def _get_y_lims_for_range(r):
     return [r[0] - d, r[1] + d]
 
 
-def plot_cum_precision(ax, y, y_pred_proba, label=None, color=TEST_COLOR):
-    # Sorting the class 1 probabilities and labels
-    df = pd.DataFrame({'labels': y, 'pred': y_pred_proba})
-    df = df.sort_values(by=['pred'], ascending=False)
+def plot_cum_precision(ax, y, y_pred_proba, label=None, color=TEST_COLOR, curves=None, max_points=1000):
+    curves = _get_curves(y, y_pred_proba, curves)
 
     # Calculating baseline for class 1 occurrence
-    baseline = df['labels'].sum() / len(df['labels'])
+    baseline = curves.n_pos / curves.n
 
     # Computing lift curve
-    df['cumsum'] = df['labels'].cumsum()
-    df['one'] = 1
-    df['rank'] = df['one'].cumsum()
-    df['fraction'] = df['rank'] / len(df['labels'])
-    df['lift'] = df['cumsum'] / df['rank']
+    fraction, lift = decimate_curve(*curves.cum_precision(), max_points=max_points)
 
     # Plotting the graph
     ax.set_title('Cumulative Precision')
-    ax.plot(df['fraction'], df['lift'], label=label, color=color)
+    ax.plot(fraction, lift, label=label, color=color)
     ax.axhline(y=baseline, color=BASELINE_COLOR, linestyle='dotted')
     ax.legend(loc="upper right")
 
@@ -115,32 +142,40 @@ def plot_cum_precision(ax, y, y_pred_proba, label=None, color=TEST_COLOR):
     return ax
 
 
-def plot_sorted_probabilities(ax, y, y_pred_proba, color=TEST_COLOR, ascending=True, label=None):
-    # Sorting the class 1 probabilities and labels
-    df = pd.DataFrame({'labels': y, 'pred_proba': y_pred_proba})
-    df = df.sort_values(by=['pred_proba'], ascending=ascending)
-
-    df['one'] = 1
-    df['rank'] = df['one'].cumsum()
-    df['fraction'] = df['rank'] / len(df['labels'])
+def plot_sorted_probabilities(ax, y, y_pred_proba, color=TEST_COLOR, ascending=True, label=None, curves=None,
+                              max_points=1000):
+    fraction, pred_proba = _get_curves(y, y_pred_proba, curves).sorted_probabilities(ascending=ascending)
+    fraction, pred_proba = decimate_curve(fraction, pred_proba, max_points)
 
     # Plotting the graph
     ax.set_title('Sorted probabilities')
-    ax.plot(df['fraction'], df['pred_proba'], color=color, label=label)
+    ax.plot(fraction, pred_proba, color=color, label=label)
     ax.legend(loc="upper center")
     return ax
 
 
-def plot_prediction_distribution(ax, y_pred_proba, *args, **kwargs):
-    ax.hist(y_pred_proba, bins=20, density=True, *args, **kwargs)
+def plot_prediction_distribution(ax, y_pred_proba, *args, curves=None, **kwargs):
+    if curves is None:
+        ax.hist(y_pred_proba, bins=20, density=True, *args, **kwargs)
+    else:
+        # Plots the histograms of the curves (one or a tuple of curves), which do not need the predictions themselves
+        curves_list = list(curves) if isinstance(curves, (list, tuple)) else [curves]
+        hist_range = (min(c.min_score for c in curves_list), max(c.max_score for c in curves_list))
+        histograms = [c.prediction_histogram(n_bins=20, range=hist_range) for c in curves_list]
+        edges = histograms[0][1]
+        bin_starts = [edges[:-1]] * len(histograms)
+        counts = [hist_counts for hist_counts, _ in histograms]
+        if not isinstance(curves, (list, tuple)):
+            bin_starts, counts = bin_starts[0], counts[0]
+        ax.hist(bin_starts, bins=edges, weights=counts, density=True, *args, **kwargs)
     ax.legend(loc='upper right')
     return ax
 
 
 def plot_calibration_curve(ax, y_true, y_pred_proba, label=None, color=TEST_COLOR, legend_loc='best',
-                           strategy='uniform', max_val=1):
-    fraction_of_positives, mean_predicted_value = calibration_curve(y_true, y_pred_proba, n_bins=20,
-                                                                    strategy=strategy)
+                           strategy='uniform', max_val=1, curves=None):
+    fraction_of_positives, mean_predicted_value = _get_curves(y_true, y_pred_proba, curves).calibration_curve(
+        n_bins=20, strategy=strategy)
 
     ax.set_title('Calibration plots (reliability curve)')
     ax.set_ylabel("Fraction of positives")
@@ -157,12 +192,12 @@ def plot_calibration_curve(ax, y_true, y_pred_proba, label=None, color=TEST_COLO
 
 
 def plot_calibration_curve_zoom(ax, y_true, y_pred_proba, label=None, color=TEST_COLOR, legend_loc='best',
-                                strategy='quantile', max_val=None):
-    fraction_of_positives, mean_predicted_value = calibration_curve(y_true, y_pred_proba, n_bins=20,
-                                                                    strategy=strategy)
+                                strategy='quantile', max_val=None, curves=None):
+    curves = _get_curves(y_true, y_pred_proba, curves)
+    fraction_of_positives, mean_predicted_value = curves.calibration_curve(n_bins=20, strategy=strategy)
 
     if not max_val:
-        max_val = max(y_pred_proba)
+        max_val = curves.max_score
 
     ax.set_title('Calibration plots (reliability curve)')
     ax.set_ylabel("Fraction of positives")
@@ -2,17 +2,35 @@ import logging
 import math
 from pathlib import Path
 
+from joblib import Parallel, delayed
 import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
 from pandas.api.types import is_numeric_dtype, is_bool_dtype
+from scipy import sparse
 import shap
 
+from myautoml.evaluation.shap_values import dense_columns
+from myautoml.visualisation import new_figure
+
 _logger = logging.getLogger(__name__)
 
+# The number of features in the Shap summary plots
+MAX_DISPLAY = 20
+
+
+def _top_features(shap_values, shap_data, shap_feature_names, max_display=MAX_DISPLAY):
+    # The summary plots only show the most important features, so only their columns of the (possibly sparse) data
+    # are densified
+    top = np.sort(np.argsort(np.abs(shap_values).sum(axis=0))[-max_display:])
+    return shap_values[:, top], dense_columns(shap_data, top), [shap_feature_names[i] for i in top]
+
 
 def save_shap_summary(save_dir, shap_values, shap_data, shap_feature_names):
     _logger.debug("Plotting Shap summary diagram")
     save_path = Path(save_dir) / 'shap_summary.png'
-    shap.summary_plot(shap_values, shap_data, show=False, feature_names=shap_feature_names)
+    shap_values, shap_data, shap_feature_names = _top_features(shap_values, shap_data, shap_feature_names)
+    shap.summary_plot(shap_values, shap_data, show=False, feature_names=shap_feature_names, max_display=MAX_DISPLAY)
     fig = plt.gcf()
     fig.set_figwidth(10)
     fig.set_figheight(5)
@@ -24,7 +42,9 @@ def save_shap_summary(save_dir, shap_values, shap_data, shap_feature_names):
 def save_shap_summary_bar(save_dir, shap_values, shap_data, shap_feature_names):
     _logger.debug("Plotting Shap summary bar diagram")
     save_path = Path(save_dir) / 'shap_summary_bar.png'
-    shap.summary_plot(shap_values, shap_data, plot_type='bar', show=False, feature_names=shap_feature_names)
+    shap_values, shap_data, shap_feature_names = _top_features(shap_values, shap_data, shap_feature_names)
+    shap.summary_plot(shap_values, shap_data, plot_type='bar', show=False, feature_names=shap_feature_names,
+                      max_display=MAX_DISPLAY)
     fig = plt.gcf()
     fig.set_figwidth(10)
     fig.set_figheight(5)
@@ -33,78 +53,172 @@ def save_shap_summary_bar(save_dir, shap_values, shap_data, shap_feature_names):
     return save_path
 
 
-# noinspection DuplicatedCode
-def save_shap_dependence_plots(save_dir, shap_values, shap_data, shap_feature_names, display_features,
-                               preprocessor=None, ignore_plot_errors=False):
-    # Plot dependence plots for each variable in the model
-    save_paths = []
-    for col in shap_feature_names:
-        _logger.debug(f"Plotting dependence plot for {col}")
-        save_path = Path(save_dir) / f"shap_dependence_{col}.png"
+def select_dependence_features(shap_values, shap_feature_names, features=None, top_k=None):
+    """
+    Selects the features to plot the dependence plots of.
+
+    :param shap_values:         The SHAP values of the positive class
+    :param shap_feature_names:  The names of the (preprocessed) features
+    :param features:            An optional allow-list of the names of the features to plot
+    :param top_k:               The number of features with the highest mean absolute SHAP value to plot, or None to
+                                plot all (allowed) features
+    :return:                    The names of the selected features, by decreasing importance if top_k is set
+    """
+    selected = [col for col in shap_feature_names if features is None or col in set(features)]
+    if top_k is not None:
+        importance = dict(zip(shap_feature_names, np.abs(shap_values).mean(axis=0)))
+        selected = sorted(selected, key=lambda col: importance[col], reverse=True)[:top_k]
+    return selected
+
+
+def _to_number(value):
+    # Booleans are plotted as 0 and 1
+    if is_bool_dtype(type(value)):
+        return int(value)
+    return value
+
+
+def _tick_values(col, values):
+    # TODO: Check the following hacky solution to fix the x-axis labels in terms of the original data
+    min_val = _to_number(values.min())
+    max_val = _to_number(values.max())
+
+    d = max_val - min_val
+    factors = 0
+    while d > 10:
+        d = d / 10
+        factors = factors + 1
+
+    min_tick = (10 ** factors) * math.ceil(min_val / (10 ** factors))
+    max_tick = (10 ** factors) * math.floor(max_val / (10 ** factors))
+
+    # TODO: This specific solution for age should be dealt with differently
+    step = 10 if col == 'age' else 10 ** factors
+    return list(range(min_tick, max_tick + 1, step))
+
+
+def get_dependence_ticks(cols, shap_feature_names, display_features, preprocessor):
+    """
+    Computes the x-axis ticks of the dependence plots of numeric features, in terms of the original data.
+
+    The tick values of all features are transformed at once, in a single call to preprocessor.transform, instead of
+    once per feature.
+
+    :param cols:                The names of the features to plot
+    :param shap_feature_names:  The names of the (preprocessed) features
+    :param display_features:    The (unprocessed) data
+    :param preprocessor:        The fitted preprocessor
+    :return:                    A dict with a (tick positions, tick values) tuple per numeric feature
+    """
+    if preprocessor is None:
+        return {}
+    cols = [col for col in cols if col in display_features.columns and is_numeric_dtype(display_features[col])]
+    tick_values = {}
+    for col in cols:
+        # A column without ticks (e.g. all NaN in the sample) keeps the default axis, without affecting the others
         try:
-            shap.dependence_plot(ind=col,
-                                 shap_values=shap_values,
-                                 features=shap_data,
-                                 display_features=display_features[shap_feature_names],
-                                 # interaction_index=col,
-                                 interaction_index=None,
-                                 show=False,
-                                 feature_names=shap_feature_names)
-            fig = plt.gcf()
-            fig.set_figwidth(10)
-            fig.set_figheight(5)
-
-            # TODO: Check the following hacky solution to fix the x-axis labels in terms of the original data
-            if is_numeric_dtype(display_features[col]):
-                min_val = display_features[col].min()
-                max_val = display_features[col].max()
-                if is_bool_dtype(min_val) and min_val:
-                    min_val = 1
-                elif is_bool_dtype(min_val) and not min_val:
-                    min_val = 0
-                else:
-                    min_val = min_val
-
-                if is_bool_dtype(max_val) and max_val:
-                    max_val = 1
-                elif is_bool_dtype(max_val) and not max_val:
-                    max_val = 0
-                else:
-                    max_val = max_val
-
-                diff = max_val - min_val
-                d = diff
-                factors = 0
-                while d > 10:
-                    d = d / 10
-                    factors = factors + 1
-
-                min_tick = (10 ** factors) * math.ceil(min_val / (10 ** factors))
-                max_tick = (10 ** factors) * math.floor(max_val / (10 ** factors))
-
-                ticks_values = [x for x in range(min_tick, max_tick + 1, 10 ** factors)]
-
-                # TODO: This specific solution for age should be dealt with differently
-                if col == 'age':
-                    ticks_values = [x for x in range(min_tick, max_tick + 1, 10)]
-                # df_ticks_values = pd.DataFrame(ticks_values, columns=[col])
-
-                df_ticks_values = display_features.head(len(ticks_values)).copy()
-                df_ticks_values[col] = ticks_values
-
-                ticks = preprocessor.transform(df_ticks_values)
-                col_idx = shap_feature_names.index(col)
-                ticks = ticks[:, col_idx]
-
-                plt.xticks(ticks, ticks_values)
-
-            plt.axhline(y=0, color='black', linestyle='--', alpha=0.4)
-            fig.savefig(save_path, bbox_inches="tight")
-            plt.close(fig)
-            save_paths.append(save_path)
-        except Exception as e:
-            if ignore_plot_errors:
-                _logger.error(e)
-            else:
-                raise
-    return save_paths
+            values = _tick_values(col, display_features[col])
+        except (TypeError, ValueError, OverflowError) as e:
+            _logger.debug(f"No ticks for the dependence plot of {col}: {str(e)}")
+            continue
+        if len(values) > 0:
+            tick_values[col] = values
+    if len(tick_values) == 0:
+        return {}
+
+    # One block of rows per feature, with the tick values of that feature and the other columns of the first rows
+    frames = []
+    for col, values in tick_values.items():
+        frame = display_features.iloc[np.arange(len(values)) % len(display_features)].copy()
+        frame[col] = values
+        frames.append(frame)
+    transformed = preprocessor.transform(pd.concat(frames, ignore_index=True))
+
+    ticks = {}
+    start = 0
+    for col, values in tick_values.items():
+        col_idx = shap_feature_names.index(col)
+        positions = transformed[start:start + len(values), col_idx]
+        if hasattr(positions, 'toarray'):
+            positions = positions.toarray()
+        ticks[col] = (np.ravel(positions), values)
+        start += len(values)
+    return ticks
+
+
+def _save_dependence_plot(save_path, col, shap_values, features, display_features, ticks, ignore_plot_errors):
+    # Draws the dependence plot of one feature, from the columns of that feature only
+    _logger.debug(f"Plotting dependence plot for {col}")
+    try:
+        fig, ax = new_figure()
+        fig.set_figwidth(10)
+        fig.set_figheight(5)
+        shap.dependence_plot(ind=0,
+                             shap_values=shap_values,
+                             features=features,
+                             display_features=display_features,
+                             interaction_index=None,
+                             show=False,
+                             feature_names=[col],
+                             ax=ax)
+        if ticks is not None:
+            ax.set_xticks(ticks[0])
+            ax.set_xticklabels(ticks[1])
+        ax.axhline(y=0, color='black', linestyle='--', alpha=0.4)
+        fig.savefig(save_path, bbox_inches="tight")
+        return save_path
+    except Exception as e:
+        if ignore_plot_errors:
+            _logger.error(e)
+            return None
+        raise
+
+
+def save_shap_dependence_plots(save_dir, shap_values, shap_data, shap_feature_names, display_features,
+                               preprocessor=None, ignore_plot_errors=False, features=None, top_k=None, n_jobs=None):
+    """
+    Saves the Shap dependence plots of the features.
+
+    The plots are drawn without pyplot, each from the columns of its own feature, so with n_jobs, they are rendered
+    concurrently in a pool of worker processes (see joblib.Parallel). Sparse data is only densified per plotted column.
+
+    :param save_dir:            The directory to save the plots in
+    :param shap_values:         The SHAP values of the positive class
+    :param shap_data:           The (preprocessed) data of the SHAP values
+    :param shap_feature_names:  The names of the (preprocessed) features
+    :param display_features:    The (unprocessed) data, to label the x-axis in terms of the original values
+    :param preprocessor:        The fitted preprocessor, to compute the x-axis ticks of numeric features
+    :param ignore_plot_errors:  Boolean indicator to log errors of the plots, instead of raising them
+    :param features:            An optional allow-list of the names of the features to plot
+    :param top_k:               The number of most important features to plot, or None to plot all (allowed) features
+    :param n_jobs:              The number of plots to render in parallel
+    :return:                    The paths of the saved plots
+    """
+    Path(save_dir).mkdir(parents=True, exist_ok=True)
+    cols = select_dependence_features(shap_values, shap_feature_names, features=features, top_k=top_k)
+    if len(cols) < len(shap_feature_names):
+        _logger.debug(f"Plotting the dependence plots of {len(cols)} of the {len(shap_feature_names)} features")
+    try:
+        ticks = get_dependence_ticks(cols, shap_feature_names, display_features, preprocessor)
+    except Exception as e:
+        if not ignore_plot_errors:
+            raise
+        _logger.error(e)
+        ticks = {}
+
+    if sparse.issparse(shap_data):
+        # Column slices of a CSC matrix do not scan all rows
+        shap_data = shap_data.tocsc()
+
+    def plot_args(col):
+        col_idx = shap_feature_names.index(col)
+        display_col = display_features[[col]] if col in display_features.columns else None
+        return (Path(save_dir) / f"shap_dependence_{col}.png", col, shap_values[:, [col_idx]],
+                dense_columns(shap_data, [col_idx]), display_col, ticks.get(col), ignore_plot_errors)
+
+    if n_jobs is None or n_jobs == 1 or len(cols) <= 1:
+        save_paths = [_save_dependence_plot(*plot_args(col)) for col in cols]
+    else:
+        _logger.debug(f"Rendering {len(cols)} dependence plots in parallel (n_jobs={n_jobs})")
+        save_paths = Parallel(n_jobs=n_jobs)(delayed(_save_dependence_plot)(*plot_args(col)) for col in cols)
+    return [save_path for save_path in save_paths if save_path is not None]
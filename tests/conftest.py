@@ -0,0 +1,14 @@
+import pytest
+
+from myautoml.utils.cache import cache_paths, close_cache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Points the cache at a temporary dir, and restores the previous cache dir afterwards."""
+    cache_dir = tmp_path / 'cache'
+    monkeypatch.setenv("MYAUTOML_CACHE_DIR", str(cache_dir))
+    # Restored by monkeypatch at teardown, after the cache of the temporary dir has been closed
+    monkeypatch.setattr(cache_paths, '_myautoml_cache_dir', cache_dir)
+    yield cache_dir
+    close_cache()
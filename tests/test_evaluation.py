@@ -0,0 +1,353 @@
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import shap
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import average_precision_score, f1_score, roc_auc_score, roc_curve
+from sklearn.model_selection import cross_validate
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from myautoml.evaluation.binary_classifier import (CALIBRATION_PLOTS, EVALUATION_PLOTS, get_metrics, get_plots,
+                                                   render_curves)
+from myautoml.evaluation.bootstrap import bootstrap_metrics
+from myautoml.evaluation.cross_validation import SCORERS, cross_validate_binary_classifier, get_cv_splits
+from myautoml.evaluation.curves import BinaryClassifierCurves, lift_table
+from myautoml.evaluation.prediction import predict_labels, predict_proba
+from myautoml.evaluation.sampling import sample_rows
+from myautoml.evaluation.shap import shap_analyse, shap_rank_stability
+from myautoml.evaluation.shap_values import compute_shap_values, get_shap_values
+from myautoml.evaluation.stored_curves import load_curves, save_curves
+from myautoml.evaluation.streaming import StreamingBinaryClassifierCurves
+from myautoml.utils.cache import cache_stats, get_memory_cache
+from myautoml.visualisation.evaluation import decimate_curve
+from myautoml.visualisation.evaluation.shap import get_dependence_ticks, save_shap_dependence_plots
+
+
+def _example_predictions(n=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    y_pred_proba = np.round(rng.random(n), 2)
+    y_true = (rng.random(n) < y_pred_proba).astype(int)
+    return y_true, y_pred_proba
+
+
+def test_binary_classifier_curves():
+    y_true, y_pred_proba = _example_predictions()
+    curves = BinaryClassifierCurves(y_true, y_pred_proba)
+
+    assert np.isclose(curves.roc_auc(), roc_auc_score(y_true, y_pred_proba))
+    assert np.isclose(curves.average_precision(), average_precision_score(y_true, y_pred_proba))
+    for expected, actual in zip(roc_curve(y_true, y_pred_proba), curves.roc_curve()):
+        np.testing.assert_allclose(actual, expected)
+
+    fraction, cum_precision = curves.cum_precision()
+    assert np.isclose(cum_precision[-1], y_true.mean())
+    assert len(curves.lift_deciles()) == 10
+
+
+def test_predict_proba():
+    rng = np.random.default_rng(0)
+    x = pd.DataFrame(rng.normal(size=(500, 3)), columns=['a', 'b', 'c'])
+    y = np.where(x['a'] + rng.normal(size=500) > 0, 'yes', 'no')
+    model = LogisticRegression().fit(x, y)
+    expected = model.predict_proba(x)[:, 1]
+
+    np.testing.assert_allclose(predict_proba(model, x), expected)
+    np.testing.assert_allclose(predict_proba(model, x, chunk_size=64), expected)
+    np.testing.assert_allclose(predict_proba(model, x, chunk_size=64, n_jobs=2), expected)
+    np.testing.assert_allclose(predict_proba(model, x, chunk_size=64, n_jobs=2, backend='loky'), expected)
+
+    np.testing.assert_array_equal(predict_labels(model, expected, 0.5), model.predict(x))
+    assert (predict_labels(model, expected, 0.9) == 'yes').sum() < (model.predict(x) == 'yes').sum()
+
+
+def test_cross_validate_binary_classifier():
+    rng = np.random.default_rng(0)
+    x = rng.random((300, 3))
+    y = (rng.random(300) < x[:, 0]).astype(int)
+    model = LogisticRegression()
+
+    scores = cross_validate_binary_classifier(model, x, y, cv=5, n_jobs=2)
+    expected = cross_validate(model, x, y, scoring=SCORERS, cv=5)
+    for scorer in SCORERS:
+        assert np.isclose(scores[scorer], expected[f"test_{scorer}"].mean())
+
+    # The splits are reused for the same target and strategy
+    assert get_cv_splits(y, cv=5) is get_cv_splits(y.copy(), cv=5)
+    assert len(get_cv_splits(y, cv='holdout', random_state=0)) == 1
+
+
+def test_streaming_binary_classifier_curves():
+    y_true, y_pred_proba = _example_predictions(n=2000)
+    exact = BinaryClassifierCurves(y_true, y_pred_proba)
+
+    # Accumulated in chunks on two workers, and merged
+    first, second = StreamingBinaryClassifierCurves(), StreamingBinaryClassifierCurves()
+    for start in range(0, 1000, 300):
+        first.update(y_true[start:min(start + 300, 1000)], y_pred_proba[start:min(start + 300, 1000)])
+    second.update(y_true[1000:], y_pred_proba[1000:])
+    streaming = first + second
+
+    assert streaming.n == exact.n and streaming.n_pos == exact.n_pos
+    # The probabilities are rounded to 2 decimals, so each one has its own bin and the results are exact
+    assert np.isclose(streaming.roc_auc(), exact.roc_auc())
+    assert np.isclose(streaming.average_precision(), exact.average_precision())
+    assert streaming.classification_metrics(0.5) == exact.classification_metrics(0.5)
+    assert np.isclose(streaming.max_score, exact.max_score)
+
+    # With a coarse resolution, the error of the ROC AUC is bounded by the fraction of pairs in the same bin
+    coarse = StreamingBinaryClassifierCurves(n_bins=10).update(y_true, y_pred_proba)
+    assert abs(coarse.roc_auc() - exact.roc_auc()) <= np.sum(coarse.pos_counts * coarse.neg_counts) / (
+        coarse.n_pos * coarse.n_neg)
+
+
+def test_bootstrap_metrics():
+    y_true, y_pred_proba = _example_predictions()
+    curves = BinaryClassifierCurves(y_true, y_pred_proba)
+
+    intervals = bootstrap_metrics(curves, n_bootstrap=100, random_state=0)
+    assert intervals['roc_auc'][0] < curves.roc_auc() < intervals['roc_auc'][1]
+    assert intervals['average_precision'][0] < curves.average_precision() < intervals['average_precision'][1]
+    assert intervals == bootstrap_metrics(curves, n_bootstrap=100, random_state=0)
+
+
+def test_get_metrics_bootstrap():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(300, 2))
+    y = (x[:, 0] + rng.normal(size=300) > 0).astype(int)
+    model = LogisticRegression().fit(x, y)
+
+    def get_intervals(random_state):
+        metrics = get_metrics(model, {'test': {'x': x, 'y': y}}, n_bootstrap=50, random_state=random_state)
+        return {name: value for name, value in metrics.items() if '_ci_' in name}
+
+    # With a seed, the confidence intervals are reproducible
+    intervals = get_intervals(1)
+    assert len(intervals) > 0 and intervals == get_intervals(1)
+    assert intervals != get_intervals(2)
+
+
+def test_threshold_sweep():
+    y_true, y_pred_proba = _example_predictions()
+    curves = BinaryClassifierCurves(y_true, y_pred_proba)
+
+    sweep = curves.threshold_sweep()
+    assert len(sweep) == len(np.unique(y_pred_proba)) + 1
+    for row in sweep.sample(20, random_state=0).itertuples():
+        y_pred = (y_pred_proba > row.threshold).astype(int)
+        assert row.tp == np.sum((y_pred == 1) & (y_true == 1)) and row.fp == np.sum((y_pred == 1) & (y_true == 0))
+        assert np.isclose(row.f1, f1_score(y_true, y_pred, zero_division=0))
+
+    threshold, f1 = curves.optimal_threshold('f1')
+    assert f1 == sweep['f1'].max()
+    assert np.isclose(curves.classification_metrics(threshold)['f1'], f1)
+
+
+def test_lift_table():
+    y_true, y_pred_proba = _example_predictions()
+
+    # The lift of the percentiles matches a groupby over pandas.qcut, from the highest bin to the lowest
+    df = pd.DataFrame({'y': y_true, 'p': y_pred_proba})
+    expected = df.groupby(pd.qcut(df['p'], 100, duplicates='drop'), observed=True)['y'].mean() / y_true.mean()
+    table = lift_table(y_true, y_pred_proba, n_bins=100)
+    np.testing.assert_allclose(table['lift'], expected.to_numpy()[::-1])
+    assert table['count'].sum() == len(y_true) and np.isclose(table['gain'].iloc[-1], 1)
+
+
+def test_sample_rows():
+    y = np.r_[np.zeros(900), np.ones(100)]
+
+    sample = sample_rows(len(y), 0.1, y=y, random_state=0)
+    assert len(sample) == 100 and y[sample].sum() == 10
+    background = sample_rows(len(y), 50, y=y, random_state=0, exclude=sample)
+    assert len(background) == 50 and len(np.intersect1d(sample, background)) == 0
+
+
+def _example_explainer(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.random((n, 5))
+    y = (x[:, 0] + rng.random(n) * 0.5 > 0.8).astype(int)
+    estimator = RandomForestClassifier(10, max_depth=4, random_state=seed).fit(x, y)
+    return shap.TreeExplainer(estimator), estimator, x
+
+
+def test_parallel_shap_values():
+    explainer, _, x = _example_explainer()
+    expected = compute_shap_values(explainer, x)
+    for data in (x, sparse.csr_matrix(x)):
+        # The chunks of the worker processes are reassembled in the order of the rows
+        np.testing.assert_allclose(compute_shap_values(explainer, data, n_jobs=2, chunk_size=70), expected)
+
+
+def test_sparse_shap_values():
+    # A categorical with 1000 levels, one-hot encoded into a sparse matrix
+    rng = np.random.default_rng(0)
+    n = 4000
+    x = pd.DataFrame({'category': rng.integers(0, 1000, n).astype(str), 'number': rng.random(n)})
+    y = ((x['category'].str[-1] == '7') | (x['number'] > 0.9)).astype(int)
+    preprocessor = ColumnTransformer([('onehot', OneHotEncoder(handle_unknown='ignore'), ['category'])],
+                                     remainder='passthrough')
+    data = preprocessor.fit_transform(x)
+    assert sparse.issparse(data)
+    explainer = shap.TreeExplainer(RandomForestClassifier(10, max_depth=6, random_state=0).fit(data, y))
+
+    tracemalloc.start()
+    shap_values = compute_shap_values(explainer, data, chunk_size=200)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Only a chunk of rows is densified at a time, instead of the whole matrix (of the same size as the SHAP values)
+    assert shap_values.shape == data.shape
+    assert peak < 1.5 * shap_values.nbytes
+    expected = compute_shap_values(explainer, data[:200].toarray())
+    np.testing.assert_allclose(shap_values[:200], expected)
+
+
+def test_stored_curves(tmp_path):
+    y_true, y_pred_proba = _example_predictions()
+    curves = BinaryClassifierCurves(y_true, y_pred_proba)
+    y_test, y_test_pred_proba = _example_predictions(seed=1)
+    data = {'train': {'y': y_true, 'y_pred_proba': y_pred_proba, 'curves': curves},
+            'test': {'y': y_test, 'y_pred_proba': y_test_pred_proba,
+                     'curves': BinaryClassifierCurves(y_test, y_test_pred_proba)}}
+    curves_path = save_curves(tmp_path, data, max_points=50, plots=EVALUATION_PLOTS)
+
+    stored_curves = load_curves(curves_path)['train']
+    assert (stored_curves.n, stored_curves.n_pos) == (curves.n, curves.n_pos)
+    assert np.isclose(stored_curves.roc_auc(), curves.roc_auc())
+    assert np.isclose(stored_curves.average_precision(), curves.average_precision())
+    fpr, tpr, _ = curves.roc_curve()
+    for expected, actual in zip(decimate_curve(fpr, tpr, 50), stored_curves.roc_curve()):
+        assert len(actual) <= 50
+        np.testing.assert_allclose(actual, expected, rtol=1e-6)
+    precision, recall, _ = curves.precision_recall_curve()
+    expected_recall, expected_precision = decimate_curve(recall, precision, 50)
+    actual_precision, actual_recall, _ = stored_curves.precision_recall_curve()
+    np.testing.assert_allclose(actual_recall, expected_recall, rtol=1e-6)
+    np.testing.assert_allclose(actual_precision, expected_precision, rtol=1e-6)
+
+    # By default, the plots the curves have been evaluated with are rendered
+    artifacts = render_curves(curves_path, tmp_path / 'plots')
+    assert sorted(path.name for path in artifacts) == ['cum_precision.png', 'lift_deciles.png',
+                                                       'precision_recall.png', 'prediction_distribution.png',
+                                                       'roc.png']
+    assert all(path.exists() for path in artifacts)
+
+
+def test_parallel_plots(tmp_path):
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(400, 2))
+    y = (x[:, 0] + rng.normal(size=400) > 0).astype(int)
+    model = LogisticRegression().fit(x, y)
+    data = {'train': {'x': x[:300], 'y': y[:300]}, 'test': {'x': x[300:], 'y': y[300:]}}
+    get_metrics(model, data)
+
+    # The worker processes render the same plots as the main process
+    serial_artifacts = get_plots(tmp_path / 'serial', data, CALIBRATION_PLOTS)
+    parallel_artifacts = get_plots(tmp_path / 'parallel', data, CALIBRATION_PLOTS, n_jobs=2)
+    assert len(serial_artifacts) == len(CALIBRATION_PLOTS)
+    assert sorted(path.name for path in parallel_artifacts) == sorted(path.name for path in serial_artifacts)
+    assert sorted(p.name for p in (tmp_path / 'parallel').rglob('*.png')) == sorted(
+        p.name for p in (tmp_path / 'serial').rglob('*.png'))
+    assert set(parallel_artifacts.values()) == {'evaluation'}
+
+
+def test_shap_rank_stability():
+    rng = np.random.default_rng(0)
+    # Features of clearly different importance have a stable ranking
+    shap_values = rng.normal(size=(200, 5)) * np.array([5., 3., 2., 1., .5])
+    assert shap_rank_stability(shap_values, random_state=0) > 0.9
+    assert shap_rank_stability(shap_values, random_state=0) == shap_rank_stability(shap_values, random_state=0)
+    assert np.isnan(shap_rank_stability(shap_values[:3]))
+    assert np.isnan(shap_rank_stability(shap_values[:, :1]))
+
+
+def test_shap_analyse(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 300
+    x = pd.DataFrame({'age': rng.normal(40, 10, n), 'fare': rng.exponential(30, n),
+                      'sex': rng.choice(['female', 'male'], n)})
+    y = ((x['sex'] == 'female') ^ (rng.random(n) < 0.2)).astype(int)
+    preprocessor = ColumnTransformer([('scale', StandardScaler(), ['age', 'fare']),
+                                      ('onehot', OneHotEncoder(handle_unknown='ignore'), ['sex'])])
+    model = Pipeline([('preprocessor', preprocessor),
+                      ('estimator', RandomForestClassifier(10, max_depth=4, random_state=0))]).fit(x, y)
+
+    tags, artifacts, explainer, shap_data, shap_values, shap_feature_names = shap_analyse(
+        model, x, tmp_path / 'shap', return_shap_details=True, y=y, sample_size=100, background_size=50,
+        random_state=0, n_jobs=2, chunk_size=40, dependence_top_k=2)
+    assert (tags['shap_sample_size'], tags['shap_background_size']) == (100, 50)
+    assert shap_values.shape == shap_data.shape == (100, len(shap_feature_names)) == (100, 4)
+    assert -1 <= tags['shap_rank_stability'] <= 1
+    # The SHAP values of each row add up to its prediction, relative to the expected value of the background
+    np.testing.assert_allclose(tags['shap_expected_value'] + shap_values.sum(axis=1),
+                               model.steps[1][1].predict_proba(shap_data)[:, 1], atol=1e-6)
+
+    # The two summary plots and the dependence plots of the two most important features
+    assert len(artifacts) == 4 and set(artifacts.values()) == {'shap'}
+    assert all(path.exists() for path in artifacts)
+    assert sum(path.name.startswith('shap_dependence_') for path in artifacts) == 2
+
+    # Without a background size, the Shap values of all rows are computed with the tree path dependent method
+    tags, artifacts = shap_analyse(model, x, tmp_path / 'shap_all', dependence_top_k=0)
+    assert (tags['shap_sample_size'], tags['shap_background_size']) == (n, 0)
+    assert len(artifacts) == 2
+
+
+def test_shap_dependence_plots(tmp_path):
+    explainer, _, x = _example_explainer()
+    shap_values = compute_shap_values(explainer, x)
+    names = [f"x{i}" for i in range(x.shape[1])]
+    display_features = pd.DataFrame(x, columns=names)
+    preprocessor = StandardScaler().set_output(transform='pandas').fit(display_features)
+    top_2 = [names[i] for i in np.argsort(-np.abs(shap_values).mean(axis=0))[:2]]
+
+    # The two most important features, rendered by worker processes
+    paths = save_shap_dependence_plots(tmp_path / 'top_k', shap_values, x, names, display_features, preprocessor,
+                                       top_k=2, n_jobs=2)
+    assert [path.name for path in paths] == [f"shap_dependence_{col}.png" for col in top_2]
+    assert all(path.exists() for path in paths)
+
+    # The most important of the allowed features only
+    paths = save_shap_dependence_plots(tmp_path / 'features', shap_values, x, names, display_features,
+                                       features=[names[-1], top_2[1]], top_k=1, n_jobs=2)
+    assert [path.name for path in paths] == [f"shap_dependence_{top_2[1]}.png"]
+
+
+def test_dependence_ticks():
+    x = pd.DataFrame({'age': [20., 35., 50., 80.], 'body': np.nan, 'fare': [5., 10., 200., 500.]})
+    preprocessor = ColumnTransformer([('scale', StandardScaler(), ['age', 'body', 'fare'])]).fit(x)
+
+    # The all-NaN column has no ticks, without affecting the ticks of the other columns
+    ticks = get_dependence_ticks(['age', 'body', 'fare'], ['age', 'body', 'fare'], x, preprocessor)
+    assert sorted(ticks) == ['age', 'fare']
+    positions, values = ticks['age']
+    assert values == [20, 30, 40, 50, 60, 70, 80]
+    np.testing.assert_allclose(positions, (np.array(values) - x['age'].mean()) / x['age'].std(ddof=0))
+
+
+def test_cached_shap_values(cache_dir):
+    explainer, estimator, x = _example_explainer()
+
+    shap_values = get_shap_values(explainer, x, cache=True)
+    get_memory_cache().clear()
+    # An explainer of the same model hits the cache, and the number of jobs and the chunk size are not part of the key
+    cached_shap_values = get_shap_values(shap.TreeExplainer(estimator), x, n_jobs=2, chunk_size=50, cache=True)
+    np.testing.assert_array_equal(cached_shap_values, shap_values)
+    assert (cache_stats()['hits'], cache_stats()['misses']) == (1, 1)
+
+    # Other data, another model, or an explainer with a background sample miss the cache
+    get_shap_values(explainer, x[:-1], cache=True)
+    other_explainer, _, _ = _example_explainer(seed=1)
+    other_shap_values = get_shap_values(other_explainer, x, cache=True)
+    background_explainer = shap.TreeExplainer(estimator, data=x[:50], feature_perturbation='interventional')
+    background_shap_values = get_shap_values(background_explainer, x, cache=True)
+    other_background_explainer = shap.TreeExplainer(estimator, data=x[50:100], feature_perturbation='interventional')
+    get_shap_values(other_background_explainer, x, cache=True)
+    assert cache_stats()['misses'] == 5
+    np.testing.assert_allclose(other_shap_values, compute_shap_values(other_explainer, x))
+    np.testing.assert_allclose(background_shap_values, compute_shap_values(background_explainer, x))
@@ -1,4 +1,26 @@
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import threading
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import StandardScaler
+
 from myautoml.utils import recursive_update
+from myautoml.utils.cache import (cache_paths, cache_settings, cache_stats, cached, flush_cache_writes, get_memory_cache,
+                                  make_cache_key)
+from myautoml.utils.cache_writer import cache_writer
+from myautoml.utils.fingerprint import fingerprint, function_fingerprint
+from myautoml.utils.lock import FileLock
+from myautoml.utils.model import fit_preprocessor
+from myautoml.utils.pickle import COMPRESSIONS, load_pickle, save_pickle
+from myautoml.utils.storage import delete_object, load_object, object_size, save_object
 
 
 def test_recursive_update():
@@ -17,3 +39,281 @@ def test_recursive_update():
          'o': 4}
 
     assert recursive_update(a, b) == c
+
+
+def test_fingerprint():
+    x = np.arange(20.).reshape(4, 5)
+    df = pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']})
+
+    assert fingerprint(x) == fingerprint(x.copy())
+    assert fingerprint(x[:, ::2]) == fingerprint(np.ascontiguousarray(x[:, ::2]))
+    assert fingerprint(x) != fingerprint(x.reshape(5, 4))
+    assert fingerprint(df) == fingerprint(df.copy())
+    assert fingerprint(df) != fingerprint(df.assign(a=[1, 3]))
+
+
+def test_function_fingerprint():
+    def make_func(factor):
+        def func(x):
+            return x * factor
+        return func
+
+    def func(x):
+        # A comment does not change the code
+        return x * 2
+
+    def other_func(x):
+        return x + 2
+
+    assert function_fingerprint(make_func(2)) == function_fingerprint(make_func(2))
+    assert function_fingerprint(make_func(2)) != function_fingerprint(make_func(3))
+    assert function_fingerprint(func) != function_fingerprint(other_func)
+
+    # Closures over modules and unpicklable objects
+    def make_module_func():
+        import numpy as np
+
+        def func(x):
+            return np.sqrt(x)
+        return func
+
+    def make_lock_func(lock):
+        def func(x):
+            with lock:
+                return x
+        return func
+
+    assert function_fingerprint(make_module_func()) == function_fingerprint(make_module_func())
+    assert function_fingerprint(make_lock_func(threading.Lock())) == function_fingerprint(
+        make_lock_func(threading.Lock()))
+
+
+def test_cached(cache_dir):
+    calls = []
+
+    def prepare(df, factor=1):
+        calls.append(1)
+        return df * factor
+
+    df = pd.DataFrame({'a': [1, 2, 3]})
+    pd.testing.assert_frame_equal(cached(prepare)(df, factor=2), df * 2)
+    pd.testing.assert_frame_equal(cached(prepare)(df.copy(), factor=2), df * 2)
+    cached(prepare)(df, factor=3)
+    assert len(calls) == 2
+
+    get_memory_cache().clear()
+    cached(prepare)(df, factor=3)
+    assert len(calls) == 2
+
+    stats = cache_stats()
+    assert (stats['memory_hits'], stats['hits'], stats['misses'], stats['entries']) == (1, 1, 2, 2)
+    assert stats['bytes_written'] == stats['size'] > 0
+
+
+def test_cache_eviction(cache_dir):
+    cache_settings.set(max_bytes=3 * 1024 * 1024)
+    try:
+        for i in range(3):
+            cached(np.full)(2 ** 17, i)
+        stats = cache_stats()
+        assert stats['entries'] == 2 and stats['evictions'] == 1
+        assert len(list(cache_paths.data_dir.iterdir())) == 2
+    finally:
+        cache_settings.load()
+
+
+def test_cached_evicted_while_loading(cache_dir, monkeypatch):
+    cached(np.arange)(10)
+    get_memory_cache().clear()
+
+    def evicted(path, mmap_mode=None):
+        raise FileNotFoundError(path)
+
+    # A file evicted by another process between the lookup and the load is a miss, not an error
+    monkeypatch.setattr('myautoml.utils.cache.load_object', evicted)
+    np.testing.assert_array_equal(cached(np.arange)(10), np.arange(10))
+    assert cache_stats()['misses'] == 2
+
+
+def test_cached_background(cache_dir, monkeypatch):
+    calls = []
+    written = threading.Event()
+
+    def square(x):
+        calls.append(1)
+        return x ** 2
+
+    def slow_save_object(obj, path):
+        # The write only finishes once the test allows it
+        assert written.wait(timeout=10)
+        return save_object(obj, path)
+
+    monkeypatch.setattr('myautoml.utils.cache.save_object', slow_save_object)
+    x = np.arange(10)
+    result = cached(square, memory=False, background=True)(x)
+    np.testing.assert_array_equal(result, x ** 2)
+
+    # The result is returned before it has been written, and is served from the pending writes in the meantime
+    assert cache_writer.get_pending(make_cache_key(square, (x,), {})) is result
+    assert cache_stats()['entries'] == 0
+    assert cached(square, memory=False, background=True)(x) is result
+
+    written.set()
+    flush_cache_writes()
+    assert cache_writer.get_pending(make_cache_key(square, (x,), {})) is None
+    assert cache_stats()['entries'] == 1
+    np.testing.assert_array_equal(cached(square, memory=False)(x), x ** 2)
+    assert len(calls) == 1 and cache_stats()['hits'] == 1
+
+
+def test_storage(tmp_path):
+    arr = np.arange(20.).reshape(4, 5)
+    df = pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'y', 'z']}, index=[10, 20, 30])
+
+    loaded_arr = load_object(save_object(arr, tmp_path / 'arr'))
+    np.testing.assert_array_equal(loaded_arr, arr)
+    loaded_df = load_object(save_object(df, tmp_path / 'df'))
+    pd.testing.assert_frame_equal(loaded_df, df)
+
+    # Memory mapped arrays are copy-on-write: writable, without modifying the file
+    loaded_arr[0, 0] = -1
+    loaded_df.loc[10, 'a'] = -1
+    np.testing.assert_array_equal(load_object(tmp_path / 'arr.npy'), arr)
+    np.testing.assert_array_equal(load_object(tmp_path / 'arr.npy', mmap_mode=None), arr)
+
+    # Numeric DataFrames are stored column by column, and their columns are memory mapped as well
+    numeric_df = pd.DataFrame({'a': [1, 2, 3], 'b': [.5, 1.5, np.nan], 'c': [True, False, True],
+                               'd': pd.to_datetime(['2020-01-01', '2020-01-02', '2020-01-03'])}, index=[10, 20, 30])
+    numeric_df.columns = ['a', 1, 'c', 'c']
+    path = save_object(numeric_df, tmp_path / 'numeric_df')
+    assert path.suffix == '.frame'
+    loaded_df = load_object(path)
+    pd.testing.assert_frame_equal(loaded_df, numeric_df)
+    base = loaded_df.iloc[:, 1].to_numpy()
+    while not isinstance(base, np.memmap):
+        base = base.base
+    loaded_df.iloc[0, 0] = -1
+    pd.testing.assert_frame_equal(load_object(path, mmap_mode=None), numeric_df)
+    assert object_size(path) > numeric_df.memory_usage().sum()
+    delete_object(path)
+    assert not path.exists()
+
+
+@pytest.mark.parametrize('compression', [None, *COMPRESSIONS])
+@pytest.mark.parametrize('out_of_band', [False, True])
+def test_pickle(tmp_path, compression, out_of_band):
+    arr = np.arange(60.).reshape(6, 10)
+    obj = {'c': arr, 'fortran': np.asfortranarray(arr), 'strided': arr[::2, 1::3], 'df': pd.DataFrame(arr)}
+    path = tmp_path / 'obj.pkl'
+    save_pickle(obj, path, compression=compression, out_of_band=out_of_band)
+
+    loaded = load_pickle(path)
+    for key in ['c', 'fortran', 'strided']:
+        np.testing.assert_array_equal(loaded[key], obj[key])
+    assert loaded['fortran'].flags.f_contiguous
+    pd.testing.assert_frame_equal(loaded['df'], obj['df'])
+
+    if compression is None and not out_of_band:
+        # By default, the file is a regular pickle file
+        with open(path, 'rb') as f:
+            np.testing.assert_array_equal(pickle.load(f)['c'], arr)
+        np.testing.assert_array_equal(joblib.load(path)['c'], arr)
+
+
+def test_pickle_failed_write(tmp_path):
+    path = tmp_path / 'obj.pkl'
+    save_pickle([1, 2, 3], path)
+
+    # A failed write leaves the existing file intact, and removes the temporary file
+    with pytest.raises(Exception):
+        save_pickle(lambda x: x, path)
+    assert load_pickle(path) == [1, 2, 3]
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_cached_lock_name(cache_dir, monkeypatch):
+    lock_paths = []
+
+    def file_lock(path, **kwargs):
+        lock_paths.append(path)
+        return FileLock(path, **kwargs)
+
+    monkeypatch.setattr('myautoml.utils.cache.FileLock', file_lock)
+    cached(lambda x: x + 1)(1)
+    cached(lambda x: x + 1, cache_key=('increment', 1))(1)
+    assert [path.parent for path in lock_paths] == [cache_paths.lock_dir] * 2
+    assert all(re.fullmatch(r'[0-9a-f]+\.lock', path.name) for path in lock_paths)
+
+
+def _slow_square(x, log_path):
+    with open(log_path, 'a') as f:
+        f.write('computed\n')
+    time.sleep(1)
+    return x ** 2
+
+
+def _cached_slow_square(cache_dir, ttl, x, log_path):
+    os.environ['MYAUTOML_CACHE_DIR'] = str(cache_dir)
+    cache_paths.set_cache_dir()
+    cache_settings.set(ttl=ttl)
+    return cached(_slow_square, memory=False)(x, log_path)
+
+
+def _hold_lock(path):
+    FileLock(path).acquire()
+    # Exits without releasing the lock
+    os._exit(0)
+
+
+def test_cached_single_flight(tmp_path):
+    log_path = tmp_path / 'log.txt'
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(4) as pool:
+        # Only one process computes the result, the others wait for it
+        args = [(tmp_path / 'cache', 3, np.arange(5), log_path)] * 4
+        for result in pool.starmap(_cached_slow_square, args):
+            np.testing.assert_array_equal(result, np.arange(5) ** 2)
+        assert len(log_path.read_text().splitlines()) == 1
+
+        # Also when the entry has expired
+        time.sleep(3.5)
+        pool.starmap(_cached_slow_square, args)
+        assert len(log_path.read_text().splitlines()) == 2
+
+
+def test_stale_lock(tmp_path):
+    path = tmp_path / 'test.lock'
+    process = multiprocessing.get_context('spawn').Process(target=_hold_lock, args=(path,))
+    process.start()
+    process.join()
+    assert path.exists()
+
+    # The lock of a process that died is broken
+    lock = FileLock(path, stale_after=60)
+    assert lock.acquire(timeout=5)
+    lock.release()
+
+    # As is a lock of another host without heartbeat
+    path.write_text(json.dumps({'host': 'other-host', 'pid': 1, 'token': 'x', 'created': 0}))
+    os.utime(path, (time.time() - 10, time.time() - 10))
+    lock = FileLock(path, stale_after=5)
+    assert lock.acquire(timeout=5)
+    lock.release()
+    assert not path.exists()
+
+
+def test_fit_preprocessor_cached(cache_dir):
+    x = pd.DataFrame({'a': [1., 2., 3., 4.], 'b': [0., 1., 0., 1.]})
+
+    preprocessor, (x_prep,) = fit_preprocessor(StandardScaler(), x, transform=[x], cache=True)
+    get_memory_cache().clear()
+    cached_preprocessor, (cached_x_prep,) = fit_preprocessor(StandardScaler(), x.copy(), transform=[x], cache=True)
+    np.testing.assert_array_equal(cached_x_prep, x_prep)
+    np.testing.assert_array_equal(cached_preprocessor.mean_, preprocessor.mean_)
+    assert (cache_stats()['hits'], cache_stats()['misses']) == (1, 1)
+
+    # Other parameters of the preprocessor, or other data, miss the cache
+    fit_preprocessor(StandardScaler(with_mean=False), x, transform=[x], cache=True)
+    _, (other_x_prep,) = fit_preprocessor(StandardScaler(), x.assign(a=x['a'] * 2), transform=[x], cache=True)
+    assert cache_stats()['misses'] == 3
+    assert not np.array_equal(other_x_prep, x_prep)